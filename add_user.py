@@ -2,12 +2,52 @@
 """
 Script para agregar usuarios a la base de datos MongoDB
 Uso: python add_user.py
+     python add_user.py --from-csv usuarios.csv   (columnas: username,password,role)
 """
 
 from database_manager import DatabaseManager
+import argparse
+import csv
 import getpass
 
+def add_users_from_csv(path):
+    """Alta no interactiva de usuarios desde un CSV"""
+    print(f"📄 Importando usuarios desde {path}")
+    print("=" * 40)
+    
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        users = [
+            {
+                "username": row.get("username"),
+                "password": row.get("password"),
+                "role": row.get("role") or "usuario"
+            } for row in csv.DictReader(csv_file)
+        ]
+    
+    db_manager = DatabaseManager()
+    try:
+        print(f"⏳ Agregando {len(users)} usuarios...")
+        result = db_manager.add_users_bulk(users)
+        
+        if result["success"]:
+            print(f"✅ {result['message']}")
+            for error in result["errors"]:
+                # +2: la fila 1 del CSV es la cabecera
+                print(f"❌ Fila {error['index'] + 2} ({error['username']}): {error['message']}")
+        else:
+            print(f"❌ {result['message']}")
+    finally:
+        db_manager.disconnect()
+
 def main():
+    parser = argparse.ArgumentParser(description="Agregar usuarios a la base de datos")
+    parser.add_argument("--from-csv", metavar="ARCHIVO", help="CSV con columnas username,password,role")
+    args = parser.parse_args()
+    
+    if args.from_csv:
+        add_users_from_csv(args.from_csv)
+        return
+    
     print("🔐 Agregar Usuario a la Base de Datos")
     print("=" * 40)
     
@@ -4,11 +4,27 @@ API REST con FastAPI para conectar la aplicación web con MongoDB
 Uso: python api_server.py
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from database_manager import DatabaseManager
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel, ValidationError
+from database_manager import DatabaseManager, has_role
+from auth_tokens import issue_token, verify_token
+from password_hasher import run_in_pool
+from config import MAX_PAGE_SIZE, EXPORT_BATCH_SIZE, SESSION_TOKEN_TTL
+from config import (
+    LOGIN_RATE_LIMIT_USER_CAPACITY, LOGIN_RATE_LIMIT_USER_PER_MINUTE,
+    LOGIN_RATE_LIMIT_IP_CAPACITY, LOGIN_RATE_LIMIT_IP_PER_MINUTE,
+    LOGIN_RATE_LIMIT_MAX_KEYS, TRUST_FORWARDED_FOR, TRUSTED_PROXY_COUNT
+)
+from rate_limiter import TokenBucketLimiter
+from typing import List, Optional
+import csv
+import hashlib
+import io
+import json
 import logging
 
 # Configurar logging
@@ -36,6 +52,79 @@ app.add_middleware(
 # Instancia global del gestor de base de datos
 db_manager = DatabaseManager()
 
+# Limitadores de intentos de login, en memoria del proceso
+login_user_limiter = TokenBucketLimiter(
+    LOGIN_RATE_LIMIT_USER_CAPACITY, LOGIN_RATE_LIMIT_USER_PER_MINUTE, LOGIN_RATE_LIMIT_MAX_KEYS
+)
+login_ip_limiter = TokenBucketLimiter(
+    LOGIN_RATE_LIMIT_IP_CAPACITY, LOGIN_RATE_LIMIT_IP_PER_MINUTE, LOGIN_RATE_LIMIT_MAX_KEYS
+)
+
+def parse_fields(fields):
+    """Convertir el parámetro ?fields=a,b en una lista de nombres de campo"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()] or None
+
+def client_ip(request):
+    """Obtener la IP del cliente, teniendo en cuenta el proxy si está configurado"""
+    if TRUST_FORWARDED_FOR:
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",")]
+        # La entrada que añadió el proxy de confianza más externo; las anteriores pueden ser falsas
+        if len(forwarded) >= TRUSTED_PROXY_COUNT > 0 and forwarded[-TRUSTED_PROXY_COUNT]:
+            return forwarded[-TRUSTED_PROXY_COUNT]
+    return request.client.host if request.client else "desconocida"
+
+def build_etag(*parts):
+    """Generar un ETag fuerte a partir de los datos que determinan la respuesta"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+def is_not_modified(request, etag):
+    """Comprobar si el cliente ya tiene la representación indicada por el ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def not_modified_response(etag):
+    """Respuesta 304 sin cuerpo"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+def token_payload(credentials):
+    """Obtener el contenido de un token Bearer válido y no revocado, o None"""
+    if credentials is None:
+        return None
+    payload = verify_token(credentials.credentials)
+    if payload is None or not db_manager.is_token_current(payload):
+        return None
+    return payload
+
+async def optional_session(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
+    """Dependencia que devuelve la sesión del token si se envió uno válido"""
+    return token_payload(credentials)
+
+def require_role(required_role):
+    """Dependencia que exige un token de sesión con al menos el rol dado, sin consultar MongoDB"""
+    async def dependency(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
+        payload = token_payload(credentials)
+        if payload is None:
+            raise HTTPException(
+                status_code=401,
+                detail="Token inválido o expirado",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        if not has_role(payload.get("role"), required_role):
+            raise HTTPException(
+                status_code=403,
+                detail=f"Permiso denegado. Se requiere rol '{required_role}' o superior"
+            )
+        return payload
+    return dependency
+
 # Modelos Pydantic
 class LoginRequest(BaseModel):
     username: str
@@ -46,6 +135,9 @@ class UserRequest(BaseModel):
     password: str
     role: Optional[str] = "usuario"
 
+class BulkUsersRequest(BaseModel):
+    users: List[UserRequest]
+
 class RoleUpdateRequest(BaseModel):
     username: str
     new_role: str
@@ -64,11 +156,36 @@ class ProductRequest(BaseModel):
     color: str
     stock: int = 0
 
+def product_request_data(request):
+    """Convertir un ProductRequest validado al documento que se guarda"""
+    return {
+        "name": request.name,
+        "price": request.price,
+        "description": request.description,
+        "category": request.category,
+        "image": request.image,
+        "size": request.size,
+        "color": request.color,
+        "stock": request.stock
+    }
+
+class BulkProductOperation(BaseModel):
+    op: str  # "set", "adjust_price" o "delete"
+    product_id: str
+    fields: Optional[dict] = None
+    percent: Optional[float] = None
+
+class BulkProductOperationsRequest(BaseModel):
+    operations: List[BulkProductOperation]
+
 class CartItemRequest(BaseModel):
     product_id: str
     size: str = "M"
     quantity: int = 1
 
+class CartItemsRequest(BaseModel):
+    items: List[CartItemRequest]
+
 class CartUpdateRequest(BaseModel):
     product_id: str
     size: str
@@ -99,19 +216,42 @@ async def health_check():
     logger.info("Health check solicitado")
     return {"status": "OK", "message": "API funcionando correctamente"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Obtener métricas de aciertos, fallos y expulsiones de las cachés"""
+    return db_manager.get_cache_stats()
+
 @app.post("/api/auth/login")
-async def login(request: LoginRequest):
+async def login(request: LoginRequest, http_request: Request):
     """Autenticar usuario"""
     try:
         logger.info(f"Intento de login para usuario: {request.username}")
-        result = db_manager.get_user(request.username, request.password)
+        
+        # Rechazar ráfagas antes de tocar la base de datos
+        ip = client_ip(http_request)
+        retry_after = login_ip_limiter.acquire(ip) or login_user_limiter.acquire(request.username.lower())
+        if retry_after:
+            logger.warning(f"Demasiados intentos de login para usuario: {request.username} desde {ip}")
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiados intentos de login. Inténtalo más tarde",
+                headers={"Retry-After": str(retry_after)}
+            )
+        
+        # La verificación del hash consume CPU: se ejecuta en el pool de contraseñas
+        result = await run_in_pool(db_manager.get_user, request.username, request.password)
         
         if result["success"]:
             logger.info(f"Login exitoso para usuario: {request.username}")
+            login_user_limiter.reset(request.username.lower())
+            user = result["user"]
             return {
                 "success": True,
                 "message": "Login exitoso",
-                "user": result["user"]
+                "user": user,
+                "token": issue_token(user["id"], user["username"], user["role"]),
+                "token_type": "bearer",
+                "expires_in": SESSION_TOKEN_TTL
             }
         else:
             logger.warning(f"Login fallido para usuario: {request.username}")
@@ -124,18 +264,53 @@ async def login(request: LoginRequest):
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
 @app.get("/api/products")
-async def get_products():
-    """Obtener todos los productos"""
+async def get_products(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    size: Optional[str] = None,
+    color: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    sort: Optional[str] = Query(None, description="price, -price o newest"),
+    fields: Optional[str] = Query(None, description="Campos separados por comas, p. ej. name,price")
+):
+    """Obtener productos filtrados y ordenados, con paginación opcional por cursor"""
     try:
         logger.info("Solicitando lista de productos")
-        result = db_manager.get_all_products()
+        etag = build_etag(db_manager.get_catalog_version(), request.url.query)
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        
+        result = db_manager.get_all_products(
+            limit=limit,
+            cursor=cursor,
+            filters={
+                "category": category,
+                "size": size,
+                "color": color,
+                "min_price": min_price,
+                "max_price": max_price,
+                "in_stock": in_stock or None
+            },
+            sort=sort,
+            fields=parse_fields(fields)
+        )
         
         if result["success"]:
             logger.info(f"Se obtuvieron {len(result['products'])} productos")
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
             return {
                 "success": True,
-                "products": result["products"]
+                "products": result["products"],
+                "next_cursor": result["next_cursor"]
             }
+        elif result.get("error") in ("invalid_cursor", "invalid_sort", "invalid_fields"):
+            raise HTTPException(status_code=400, detail=result["message"])
         else:
             logger.error(f"Error obteniendo productos: {result['message']}")
             raise HTTPException(status_code=500, detail=result["message"])
@@ -146,21 +321,92 @@ async def get_products():
         logger.error(f"Error en get_products: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+@app.get("/api/products/export")
+async def export_products(session: dict = Depends(require_role("administrador"))):
+    """Exportar el catálogo completo como JSON delimitado por líneas (NDJSON)"""
+    logger.info(f"Exportación del catálogo solicitada por {session['username']}")
+    
+    def generate():
+        count = 0
+        try:
+            for product in db_manager.iter_products(EXPORT_BATCH_SIZE):
+                count += 1
+                yield json.dumps(product, ensure_ascii=False, default=str) + "\n"
+        except Exception as e:
+            # La respuesta ya empezó: sólo se puede registrar y cortar el stream
+            logger.error(f"Error exportando productos: {str(e)}")
+            raise
+        logger.info(f"Exportación completada: {count} productos")
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="productos.ndjson"'}
+    )
+
+@app.get("/api/products/facets")
+async def get_product_facets():
+    """Obtener conteos de productos por categoría, talla, color y rango de precio"""
+    try:
+        result = db_manager.get_product_facets()
+        
+        if result["success"]:
+            return result
+        else:
+            raise HTTPException(status_code=500, detail=result["message"])
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en get_product_facets: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+@app.get("/api/products/search")
+async def search_products(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Buscar productos por nombre, categoría, color y descripción"""
+    try:
+        logger.info(f"Buscando productos: {q}")
+        # Fuera del event loop: la primera búsqueda construye el índice con todo el catálogo
+        result = await run_in_threadpool(db_manager.search_products, q, limit)
+        
+        if result["success"]:
+            return {
+                "success": True,
+                "products": result["products"]
+            }
+        else:
+            raise HTTPException(status_code=500, detail=result["message"])
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en search_products: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
 @app.get("/api/products/{product_id}")
-async def get_product(product_id: str):
+async def get_product(product_id: str, request: Request, response: Response):
     """Obtener un producto específico"""
     try:
-        result = db_manager.get_all_products()
+        etag = build_etag(db_manager.get_catalog_version(), product_id)
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        
+        result = db_manager.get_product(product_id)
         
         if result["success"]:
-            product = next((p for p in result["products"] if p["id"] == product_id), None)
-            if product:
-                return {
-                    "success": True,
-                    "product": product
-                }
-            else:
-                raise HTTPException(status_code=404, detail="Producto no encontrado")
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            return {
+                "success": True,
+                "product": result["product"]
+            }
+        elif result.get("error") == "invalid_id":
+            raise HTTPException(status_code=400, detail=result["message"])
+        elif result.get("error") == "not_found":
+            raise HTTPException(status_code=404, detail=result["message"])
         else:
             raise HTTPException(status_code=500, detail=result["message"])
             
@@ -170,39 +416,122 @@ async def get_product(product_id: str):
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
 @app.post("/api/users")
-async def add_user(request: UserRequest):
+async def add_user(request: UserRequest, session: Optional[dict] = Depends(optional_session)):
     """Agregar nuevo usuario con rol"""
     try:
-        result = db_manager.add_user(request.username, request.password, request.role)
+        # Cualquiera puede registrarse como usuario; otros roles sólo los asigna un administrador
+        if request.role != "usuario" and not (session and has_role(session.get("role"), "administrador")):
+            raise HTTPException(
+                status_code=403,
+                detail="Permiso denegado. Se requiere rol 'administrador' para asignar otros roles"
+            )
+        
+        result = await run_in_pool(db_manager.add_user, request.username, request.password, request.role)
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+@app.post("/api/users/bulk")
+async def add_users_bulk(request: BulkUsersRequest, session: dict = Depends(require_role("administrador"))):
+    """Agregar usuarios en bloque"""
+    try:
+        logger.info(f"Alta masiva de {len(request.users)} usuarios por {session['username']}")
+        # Fuera del event loop: la llamada reparte los hashes en el pool de altas masivas y espera
+        result = await run_in_threadpool(db_manager.add_users_bulk, [
+            {"username": user.username, "password": user.password, "role": user.role}
+            for user in request.users
+        ])
+        
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail=result["message"])
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en alta masiva de usuarios: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
 @app.put("/api/users/role")
-async def update_user_role(request: RoleUpdateRequest):
+async def update_user_role(request: RoleUpdateRequest, session: dict = Depends(require_role("administrador"))):
     """Actualizar rol de usuario"""
     try:
+        logger.info(f"Cambio de rol de {request.username} a {request.new_role} por {session['username']}")
         result = db_manager.update_user_role(request.username, request.new_role)
         return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+@app.get("/api/users")
+async def get_users(
+    fields: Optional[str] = Query(None, description="username, role, created_at, is_active"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: dict = Depends(require_role("administrador"))
+):
+    """Obtener usuarios activos, con paginación opcional por cursor"""
+    try:
+        result = db_manager.get_all_users(parse_fields(fields), limit=limit, cursor=cursor)
+        if result.get("error") in ("invalid_fields", "invalid_cursor"):
+            raise HTTPException(status_code=400, detail=result["message"])
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+@app.get("/api/users/stats")
+async def get_user_stats(session: dict = Depends(require_role("administrador"))):
+    """Obtener el número de usuarios activos por rol"""
+    try:
+        result = db_manager.get_user_stats()
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail=result["message"])
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
 @app.get("/api/users/role/{role}")
-async def get_users_by_role(role: str):
-    """Obtener usuarios por rol"""
+async def get_users_by_role(
+    role: str,
+    fields: Optional[str] = Query(None, description="username, role, created_at, is_active"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    session: dict = Depends(require_role("administrador"))
+):
+    """Obtener usuarios por rol, con paginación opcional por cursor"""
     try:
-        result = db_manager.get_users_by_role(role)
+        result = db_manager.get_users_by_role(role, parse_fields(fields), limit=limit, cursor=cursor)
+        if result.get("error") in ("invalid_fields", "invalid_cursor"):
+            raise HTTPException(status_code=400, detail=result["message"])
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
 @app.post("/api/users/permission")
-async def check_permission(request: PermissionCheckRequest):
+async def check_permission(request: PermissionCheckRequest, session: Optional[dict] = Depends(optional_session)):
     """Verificar permisos de usuario"""
     try:
+        # Con un token del propio usuario el rol se resuelve sin consultar MongoDB
+        if session and session.get("username") == request.username:
+            if has_role(session.get("role"), request.required_role):
+                return {"success": True, "message": "Permiso concedido"}
+            return {
+                "success": False,
+                "message": f"Permiso denegado. Se requiere rol '{request.required_role}' o superior"
+            }
+        
         result = db_manager.check_permission(request.username, request.required_role)
         return result
         
@@ -210,8 +539,10 @@ async def check_permission(request: PermissionCheckRequest):
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
 @app.get("/api/users/roles")
-async def get_available_roles():
+async def get_available_roles(response: Response):
     """Obtener roles disponibles"""
+    # Lista estática: los clientes pueden reutilizarla durante un día
+    response.headers["Cache-Control"] = "public, max-age=86400"
     return {
         "success": True,
         "roles": [
@@ -226,37 +557,115 @@ async def add_product(request: ProductRequest):
     """Agregar nuevo producto"""
     try:
         logger.info(f"Agregando producto: {request.name}")
-        result = db_manager.add_product({
-            "name": request.name,
-            "price": request.price,
-            "description": request.description,
-            "category": request.category,
-            "image": request.image,
-            "size": request.size,
-            "color": request.color,
-            "stock": request.stock
-        })
+        result = db_manager.add_product(product_request_data(request))
         return result
         
     except Exception as e:
         logger.error(f"Error agregando producto: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+@app.post("/api/products/bulk")
+async def add_products_bulk(request: Request, session: dict = Depends(require_role("editor"))):
+    """Agregar productos en bloque desde un arreglo JSON o un CSV (Content-Type: text/csv)"""
+    try:
+        body = await request.body()
+        if "text/csv" in request.headers.get("content-type", ""):
+            try:
+                text = body.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="El CSV debe estar codificado en UTF-8")
+            reader = csv.DictReader(io.StringIO(text))
+            # Un stock vacío toma el valor por defecto del modelo
+            rows = [
+                {key: value for key, value in row.items() if key and not (key == "stock" and value == "")}
+                for row in reader
+            ]
+        else:
+            try:
+                rows = json.loads(body)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="El cuerpo debe ser un arreglo JSON o un CSV")
+            if not isinstance(rows, list):
+                raise HTTPException(status_code=400, detail="El cuerpo debe ser un arreglo JSON de productos")
+        
+        logger.info(f"Importando {len(rows)} productos")
+        products = []
+        row_numbers = []
+        errors = []
+        for row_number, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise TypeError("la fila debe ser un objeto")
+                products.append(product_request_data(ProductRequest(**row)))
+                row_numbers.append(row_number)
+            except ValidationError as e:
+                message = "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+                )
+                errors.append({"row": row_number, "message": message})
+            except TypeError as e:
+                errors.append({"row": row_number, "message": str(e)})
+        
+        result = {"success": True, "inserted_count": 0, "inserted_ids": [], "errors": []}
+        if products:
+            # Fuera del event loop: una importación grande no bloquea las demás peticiones
+            result = await run_in_threadpool(db_manager.add_products_bulk, products)
+            if not result["success"]:
+                raise HTTPException(status_code=500, detail=result["message"])
+        
+        errors.extend(
+            {"row": row_numbers[error["index"]], "message": error["message"]}
+            for error in result["errors"]
+        )
+        errors.sort(key=lambda error: error["row"])
+        
+        return {
+            "success": True,
+            "message": f"{result['inserted_count']} productos creados, {len(errors)} filas con errores",
+            "inserted_count": result["inserted_count"],
+            "inserted_ids": result["inserted_ids"],
+            "errors": errors
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en importación masiva: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+@app.patch("/api/products/bulk")
+async def update_products_bulk(
+    request: BulkProductOperationsRequest,
+    session: dict = Depends(require_role("editor"))
+):
+    """Modificar campos, ajustar precios por porcentaje o eliminar productos en bloque"""
+    try:
+        logger.info(f"Aplicando {len(request.operations)} operaciones masivas sobre productos")
+        result = await run_in_threadpool(db_manager.bulk_update_products, [
+            {
+                "op": operation.op,
+                "product_id": operation.product_id,
+                "fields": operation.fields,
+                "percent": operation.percent
+            } for operation in request.operations
+        ])
+        
+        if not result["success"]:
+            raise HTTPException(status_code=500, detail=result["message"])
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en modificación masiva: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
 @app.put("/api/products/{product_id}")
 async def update_product(product_id: str, request: ProductRequest):
     """Actualizar producto"""
     try:
         logger.info(f"Actualizando producto: {product_id}")
-        result = db_manager.update_product(product_id, {
-            "name": request.name,
-            "price": request.price,
-            "description": request.description,
-            "category": request.category,
-            "image": request.image,
-            "size": request.size,
-            "color": request.color,
-            "stock": request.stock
-        })
+        result = db_manager.update_product(product_id, product_request_data(request))
         return result
         
     except Exception as e:
@@ -289,17 +698,56 @@ async def add_to_cart(request: CartItemRequest, user_id: str):
         logger.error(f"Error agregando al carrito: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+@app.post("/api/cart/add-many")
+async def add_many_to_cart(request: CartItemsRequest, user_id: str):
+    """Agregar varios productos al carrito en una sola operación"""
+    try:
+        logger.info(f"Agregando {len(request.items)} productos al carrito del usuario {user_id}")
+        result = db_manager.add_many_to_cart(user_id, [
+            {"product_id": item.product_id, "size": item.size, "quantity": item.quantity}
+            for item in request.items
+        ])
+        
+        if result.get("error") in ("invalid_id", "invalid_quantity"):
+            raise HTTPException(status_code=400, detail=result["message"])
+        elif result.get("error") == "not_found":
+            raise HTTPException(status_code=404, detail=result["message"])
+        elif not result["success"]:
+            raise HTTPException(status_code=500, detail=result["message"])
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error agregando productos al carrito: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
 @app.get("/api/cart/{user_id}")
-async def get_cart(user_id: str):
+async def get_cart(
+    user_id: str,
+    request: Request,
+    response: Response,
+    refresh: bool = Query(False, description="Revalidar precios y stock contra el catálogo")
+):
     """Obtener carrito del usuario"""
     try:
         logger.info(f"Obteniendo carrito del usuario {user_id}")
-        result = db_manager.get_cart(user_id)
+        result = db_manager.get_cart(user_id, refresh)
         
         # Si el carrito no existe (items vacíos), devolver 404
-        if result["success"] and result["cart"]["total_items"] == 0:
+        if result["success"] and not result["cart"]["items"]:
             raise HTTPException(status_code=404, detail="Carrito no encontrado")
         
+        if result["success"]:
+            etag = build_etag(user_id, result["cart"]["updated_at"])
+            if refresh:
+                # Con refresh la respuesta depende también del catálogo
+                etag = build_etag(user_id, result["cart"]["updated_at"], db_manager.get_catalog_version())
+            if is_not_modified(request, etag):
+                return not_modified_response(etag)
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "private, no-cache"
+        
         return result
         
     except HTTPException:
@@ -370,9 +818,11 @@ if __name__ == '__main__':
     print("  POST /api/auth/login - Autenticar usuario")
     print("  GET  /api/products - Obtener productos")
     print("  GET  /api/products/{id} - Obtener producto específico")
+    print("  GET  /api/users - Listar usuarios")
     print("  POST /api/users - Agregar usuario")
     print("  GET  /api/health - Verificar estado")
     print("  POST /api/cart/add - Agregar al carrito")
+    print("  POST /api/cart/add-many - Agregar varios productos al carrito")
     print("  GET  /api/cart/{user_id} - Obtener carrito")
     print("  PUT  /api/cart/update - Actualizar carrito")
     print("  DELETE /api/cart/remove - Eliminar del carrito")
@@ -0,0 +1,74 @@
+"""
+Tokens de sesión firmados con HMAC-SHA256 (usuario, rol y expiración)
+"""
+
+from config import SESSION_SECRET, SESSION_TOKEN_TTL
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload_part):
+    return _b64encode(hmac.new(SESSION_SECRET.encode("utf-8"), payload_part.encode("utf-8"), hashlib.sha256).digest())
+
+def issue_token(user_id, username, role, ttl=SESSION_TOKEN_TTL):
+    """Emitir un token firmado para el usuario autenticado"""
+    now = time.time()
+    payload = {
+        "sub": user_id,
+        "username": username,
+        "role": role,
+        "iat": now,
+        "exp": now + ttl
+    }
+    payload_part = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return f"{payload_part}.{_sign(payload_part)}"
+
+def verify_token(token):
+    """Obtener el contenido de un token válido y vigente, o None"""
+    try:
+        payload_part, signature = token.split(".")
+    except (AttributeError, ValueError):
+        return None
+
+    if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload_part).encode("ascii")):
+        return None
+
+    try:
+        payload = json.loads(_b64decode(payload_part))
+    except ValueError:
+        return None
+
+    if not isinstance(payload, dict) or payload.get("exp", 0) <= time.time():
+        return None
+    return payload
+
+class TokenRevocations:
+    """Momento del último cambio de rol por usuario: invalida los tokens emitidos antes"""
+    def __init__(self, ttl=SESSION_TOKEN_TTL):
+        self.ttl = ttl
+        self._changed_at = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, username):
+        """Registrar un cambio de rol para revocar los tokens anteriores del usuario"""
+        now = time.time()
+        with self._lock:
+            # Los registros más antiguos que la vida de un token ya no revocan nada
+            expired = [name for name, changed_at in self._changed_at.items() if now - changed_at > self.ttl]
+            for name in expired:
+                del self._changed_at[name]
+            self._changed_at[username] = now
+
+    def is_current(self, payload):
+        """Comprobar que el rol del token no ha cambiado desde que se emitió"""
+        changed_at = self._changed_at.get(payload.get("username"))
+        return changed_at is None or payload.get("iat", 0) > changed_at
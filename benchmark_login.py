@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark del throughput de login según el coste del hash de contraseñas
+Uso: python benchmark_login.py [--iterations N] [--workers N] [--requests N]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from config import PASSWORD_HASH_ITERATIONS, PASSWORD_HASH_WORKERS
+from password_hasher import hash_password, verify_password
+import argparse
+import asyncio
+import statistics
+import time
+
+def timed_verify(password, stored):
+    """Verificar una contraseña y devolver la latencia en milisegundos"""
+    start = time.perf_counter()
+    if not verify_password(password, stored):
+        raise RuntimeError("La verificación falló")
+    return (time.perf_counter() - start) * 1000
+
+async def run_benchmark(iterations, workers, requests):
+    """Lanzar logins concurrentes contra un pool del tamaño indicado"""
+    stored = hash_password("benchmark123", iterations)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    loop = asyncio.get_running_loop()
+
+    try:
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[
+            loop.run_in_executor(pool, timed_verify, "benchmark123", stored)
+            for _ in range(requests)
+        ])
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+    latencies.sort()
+    return {
+        "throughput": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de verificación de contraseñas")
+    parser.add_argument("--iterations", type=int, default=PASSWORD_HASH_ITERATIONS, help="Coste de PBKDF2")
+    parser.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS, help="Hilos del pool")
+    parser.add_argument("--requests", type=int, default=50, help="Logins simulados")
+    args = parser.parse_args()
+
+    print("Benchmark de Login")
+    print("=" * 40)
+    print(f"Iteraciones PBKDF2: {args.iterations}")
+    print(f"Hilos del pool: {args.workers}")
+    print(f"Logins simulados: {args.requests}")
+
+    result = asyncio.run(run_benchmark(args.iterations, args.workers, args.requests))
+
+    print(f"\nThroughput: {result['throughput']:.1f} logins/s")
+    print(f"Latencia p50: {result['p50']:.1f} ms")
+    print(f"Latencia p95: {result['p95']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Conteos por faceta del catálogo (categoría, talla, color y rango de precio) mantenidos en memoria
+"""
+
+from collections import Counter
+import threading
+import time
+
+FACET_FIELDS = ("category", "size", "color")
+
+# Límites inferiores de los rangos de precio; el último rango no tiene tope
+PRICE_BOUNDARIES = [0, 25, 50, 100, 200]
+
+def price_bucket(price):
+    """Obtener la etiqueta del rango de precio ("25-50", "200+"), o None si no aplica"""
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price < PRICE_BOUNDARIES[0]:
+        return None
+    for lower, upper in zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:]):
+        if price < upper:
+            return f"{lower}-{upper}"
+    return f"{PRICE_BOUNDARIES[-1]}+"
+
+def facets_pipeline():
+    """Pipeline de agregación que calcula todas las facetas en una sola pasada"""
+    facets = {
+        field: [
+            {"$match": {field: {"$ne": None}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}
+        ]
+        for field in FACET_FIELDS
+    }
+    facets["price"] = [
+        {"$match": {"price": {"$type": "number", "$gte": PRICE_BOUNDARIES[0]}}},
+        {"$bucket": {
+            "groupBy": "$price",
+            "boundaries": PRICE_BOUNDARIES + [float("inf")],
+            "output": {"count": {"$sum": 1}}
+        }}
+    ]
+    return [{"$facet": facets}]
+
+class CatalogFacets:
+    def __init__(self):
+        self._counts = {field: Counter() for field in FACET_FIELDS + ("price",)}
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    def build(self, aggregation):
+        """Cargar los conteos a partir del resultado de facets_pipeline()"""
+        with self._lock:
+            for field in FACET_FIELDS:
+                self._counts[field] = Counter({
+                    bucket["_id"]: bucket["count"] for bucket in aggregation.get(field, [])
+                })
+            self._counts["price"] = Counter({
+                price_bucket(bucket["_id"]): bucket["count"] for bucket in aggregation.get("price", [])
+            })
+            self.built_at = time.monotonic()
+
+    def invalidate(self):
+        """Forzar el recálculo en la próxima lectura"""
+        with self._lock:
+            self.built_at = None
+
+    def add(self, product):
+        """Contar un producto nuevo"""
+        self._apply(product, 1)
+
+    def remove(self, product):
+        """Descontar un producto eliminado"""
+        self._apply(product, -1)
+
+    def snapshot(self):
+        """Obtener una copia de los conteos actuales"""
+        with self._lock:
+            return {
+                field: {str(key): count for key, count in counts.items() if count > 0}
+                for field, counts in self._counts.items()
+            }
+
+    def _apply(self, product, delta):
+        with self._lock:
+            if self.built_at is None:
+                return
+            for field in FACET_FIELDS:
+                value = product.get(field)
+                if value is not None:
+                    self._counts[field][value] += delta
+            bucket = price_bucket(product.get("price"))
+            if bucket is not None:
+                self._counts["price"][bucket] += delta
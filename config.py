@@ -1,4 +1,5 @@
 import os
+import secrets
 
 # Configuración de MongoDB usando variables de entorno
 MONGODB_URI = os.getenv("MONGODB_URI")
@@ -6,6 +7,57 @@ DB_NAME = os.getenv("DB_NAME", "login")
 COLLECTION_USERS = "users"
 COLLECTION_PRODUCTS = "products"
 COLLECTION_CART = "cart"
+COLLECTION_MIGRATIONS = "migrations"
+COLLECTION_METADATA = "metadata"
+
+# Caché en memoria del catálogo de productos
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "60"))
+CATALOG_CACHE_MAXSIZE = int(os.getenv("CATALOG_CACHE_MAXSIZE", "1024"))
+
+# Antigüedad máxima (segundos) del índice de búsqueda antes de reconstruirlo
+SEARCH_INDEX_MAX_AGE = int(os.getenv("SEARCH_INDEX_MAX_AGE", "600"))
+
+# Antigüedad máxima (segundos) de los conteos de facetas antes de recalcularlos
+FACETS_MAX_AGE = int(os.getenv("FACETS_MAX_AGE", "600"))
+
+# Coste del hash de contraseñas (iteraciones de PBKDF2) y hilos dedicados a calcularlo
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "310000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hilos para los hashes de las altas masivas, separados de los de login
+BULK_PASSWORD_HASH_WORKERS = int(os.getenv("BULK_PASSWORD_HASH_WORKERS", "1"))
+
+# Firma y duración (segundos) de los tokens de sesión. Sin SESSION_SECRET se genera
+# una clave aleatoria por proceso y los tokens dejan de valer al reiniciar
+SESSION_SECRET = os.getenv("SESSION_SECRET") or secrets.token_hex(32)
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "900"))
+
+# Caché en memoria de roles por usuario
+ROLE_CACHE_TTL = int(os.getenv("ROLE_CACHE_TTL", "300"))
+ROLE_CACHE_MAXSIZE = int(os.getenv("ROLE_CACHE_MAXSIZE", "10000"))
+
+# Caché en memoria de los datos de producto que se copian al carrito
+CART_PRODUCT_CACHE_TTL = int(os.getenv("CART_PRODUCT_CACHE_TTL", "30"))
+CART_PRODUCT_CACHE_MAXSIZE = int(os.getenv("CART_PRODUCT_CACHE_MAXSIZE", "5000"))
+
+# Límite de intentos de login (token bucket): capacidad y recarga por minuto, por usuario y por IP
+LOGIN_RATE_LIMIT_USER_CAPACITY = int(os.getenv("LOGIN_RATE_LIMIT_USER_CAPACITY", "5"))
+LOGIN_RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("LOGIN_RATE_LIMIT_USER_PER_MINUTE", "5"))
+LOGIN_RATE_LIMIT_IP_CAPACITY = int(os.getenv("LOGIN_RATE_LIMIT_IP_CAPACITY", "20"))
+LOGIN_RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("LOGIN_RATE_LIMIT_IP_PER_MINUTE", "20"))
+LOGIN_RATE_LIMIT_MAX_KEYS = int(os.getenv("LOGIN_RATE_LIMIT_MAX_KEYS", "100000"))
+# Detrás de un proxy la IP real del cliente llega en X-Forwarded-For. Sólo son fiables las
+# entradas que añaden los proxies propios (las últimas); las primeras las escribe el cliente
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "1"))
+
+# Tamaño máximo de página para los listados paginados
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+# Documentos por lote en las importaciones y modificaciones masivas
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Documentos por lote al exportar el catálogo
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
 
 # Validar que las variables de entorno estén configuradas
 if not MONGODB_URI:
@@ -1,13 +1,178 @@
-from pymongo import MongoClient
-from config import MONGODB_URI, DB_NAME, COLLECTION_USERS, COLLECTION_PRODUCTS, COLLECTION_CART
+from pymongo import MongoClient, ReturnDocument, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
+from config import MONGODB_URI, DB_NAME, COLLECTION_USERS, COLLECTION_PRODUCTS, COLLECTION_CART, COLLECTION_METADATA
+from config import ROLE_CACHE_TTL, ROLE_CACHE_MAXSIZE, CART_PRODUCT_CACHE_TTL, CART_PRODUCT_CACHE_MAXSIZE
+from config import CATALOG_CACHE_TTL, CATALOG_CACHE_MAXSIZE, SEARCH_INDEX_MAX_AGE, FACETS_MAX_AGE, BULK_CHUNK_SIZE
+from cache_manager import TTLCache
+from auth_tokens import TokenRevocations
+from search_index import ProductSearchIndex, FIELD_WEIGHTS
+from catalog_facets import CatalogFacets, FACET_FIELDS, facets_pipeline
+from password_hasher import hash_password, verify_password, needs_rehash, dummy_hash, bulk_password_pool
+from schema_migrations import upgrade_document
+import base64
 import json
+import threading
+import time
 from datetime import datetime
 
+# Jerarquía de roles: un rol incluye los permisos de los de menor nivel
+ROLE_HIERARCHY = {
+    "usuario": 1,
+    "editor": 2,
+    "administrador": 3
+}
+
+# Campos de producto que se envían al cliente
+PRODUCT_PROJECTION = {
+    "name": 1,
+    "price": 1,
+    "description": 1,
+    "category": 1,
+    "image": 1,
+    "size": 1,
+    "color": 1,
+    "stock": 1
+}
+
+# Campos de producto que se copian en cada item del carrito
+CART_PRODUCT_PROJECTION = {"name": 1, "price": 1, "image": 1}
+
+# Campos que los clientes pueden pedir con ?fields= (nunca la contraseña)
+PRODUCT_FIELDS = tuple(PRODUCT_PROJECTION)
+USER_FIELDS = ("username", "role", "created_at", "is_active")
+
+# Tipos aceptados al modificar campos de producto en bloque
+PRODUCT_FIELD_TYPES = {
+    "name": str,
+    "price": (int, float),
+    "description": str,
+    "category": str,
+    "image": str,
+    "size": str,
+    "color": str,
+    "stock": int
+}
+
+# Campos que alimentan el índice de búsqueda
+SEARCH_PROJECTION = {field: 1 for field in FIELD_WEIGHTS}
+
+# Campos necesarios para mantener el índice de búsqueda y las facetas al modificar productos
+INDEXED_PROJECTION = dict(SEARCH_PROJECTION, **{field: 1 for field in FACET_FIELDS}, price=1)
+
+# Órdenes disponibles para el listado de productos; _id desempata la paginación
+PRODUCT_SORTS = {
+    None: [("_id", 1)],
+    "price": [("price", 1), ("_id", 1)],
+    "-price": [("price", -1), ("_id", -1)],
+    "newest": [("created_at", -1), ("_id", -1)]
+}
+
+# Índices compuestos que respaldan los filtros y órdenes del catálogo
+PRODUCT_INDEXES = [
+    [("category", 1), ("price", 1), ("_id", 1)],
+    [("category", 1), ("created_at", -1), ("_id", -1)],
+    [("size", 1), ("color", 1), ("price", 1)],
+    [("color", 1), ("price", 1)],
+    [("price", 1), ("_id", 1)],
+    [("created_at", -1), ("_id", -1)]
+]
+
+# Índices de los listados de usuarios paginados por _id
+USER_INDEXES = [
+    [("is_active", 1), ("_id", 1)],
+    [("role", 1), ("is_active", 1), ("_id", 1)]
+]
+
+# Totales del carrito recalculados en el servidor a partir de sus items
+CART_TOTALS = {
+    "total_items": {"$sum": "$items.quantity"},
+    "total_price": {"$sum": {"$map": {
+        "input": "$items",
+        "in": {"$multiply": ["$$this.product_price", "$$this.quantity"]}
+    }}}
+}
+
+def cart_item_matches(product_ids, size):
+    """Expresión de agregación que identifica un item del carrito ($$this) por producto y talla"""
+    return {"$and": [{"$in": ["$$this.product_id", product_ids]}, {"$eq": ["$$this.size", size]}]}
+
+# Índices únicos de los que depende la integridad de los datos: sin ellos no se arranca
+UNIQUE_INDEXES = [
+    (COLLECTION_USERS, [("username", 1)]),
+    (COLLECTION_CART, [("user_id", 1)])
+]
+
+def has_role(user_role, required_role):
+    """Comprobar si un rol alcanza el nivel del rol requerido"""
+    return ROLE_HIERARCHY.get(user_role, 1) >= ROLE_HIERARCHY.get(required_role, 1)
+
+def to_object_id(value):
+    """Convertir un ID en texto a ObjectId, o None si no es válido"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+def canonical_product_id(product_id):
+    """Forma con la que se guarda un ID de producto en el carrito (ObjectId en hex minúsculas)"""
+    object_id = to_object_id(product_id)
+    return str(object_id) if object_id is not None else product_id
+
+def cart_product_ids(product_id):
+    """IDs con los que puede estar guardado un item: el recibido y su forma canónica"""
+    # Los carritos anteriores a la forma canónica guardaban el ID tal como lo envió el cliente
+    return list(dict.fromkeys([product_id, canonical_product_id(product_id)]))
+
+def encode_cursor(values):
+    """Codificar la posición de una página como cursor opaco"""
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Decodificar un cursor opaco, o None si no es válido"""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, dict) else None
+
+def invalid_fields_error(fields, allowed):
+    """Respuesta de error si se piden campos fuera de la lista permitida, o None"""
+    invalid = [field for field in fields or () if field not in allowed]
+    if invalid:
+        return {
+            "success": False,
+            "message": f"Campos inválidos: {', '.join(invalid)}. Campos válidos: {', '.join(allowed)}",
+            "error": "invalid_fields"
+        }
+    return None
+
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, require_unique_indexes=True):
         self.client = None
         self.db = None
+        self.catalog_cache = TTLCache(CATALOG_CACHE_MAXSIZE, CATALOG_CACHE_TTL)
+        # username -> (rol, activo)
+        self.role_cache = TTLCache(ROLE_CACHE_MAXSIZE, ROLE_CACHE_TTL)
+        # ObjectId -> datos del producto que se copian al carrito
+        self.cart_product_cache = TTLCache(CART_PRODUCT_CACHE_MAXSIZE, CART_PRODUCT_CACHE_TTL)
+        self.search_index = ProductSearchIndex()
+        # Sólo una reconstrucción del índice de búsqueda a la vez
+        self.search_index_build_lock = threading.Lock()
+        self.facets = CatalogFacets()
+        # Versión del catálogo (contador persistente en Mongo) y momento en que se leyó por última vez
+        self.catalog_version = (None, None)
+        # Cambios de rol recientes: invalidan los tokens emitidos antes
+        self.role_changes = TokenRevocations()
         self.connect()
+        try:
+            self.ensure_indexes(require_unique_indexes)
+        except Exception:
+            self.disconnect()
+            raise
     
     def connect(self):
         """Conectar a MongoDB"""
@@ -19,20 +184,80 @@ class DatabaseManager:
             print(f"Error conectando a MongoDB: {e}")
             raise e
     
+    def ensure_indexes(self, require_unique=True):
+        """Crear los índices que usan las consultas de la API; sin los índices únicos se lanza RuntimeError"""
+        indexes = (
+            [(COLLECTION_PRODUCTS, keys, {}) for keys in PRODUCT_INDEXES] +
+            [(COLLECTION_USERS, keys, {}) for keys in USER_INDEXES]
+        )
+        for collection, keys, options in indexes:
+            # Cada índice por separado: uno que falle (p. ej. por duplicados) no impide los demás
+            try:
+                self.db[collection].create_index(keys, **options)
+            except Exception as e:
+                print(f"Error creando índice {keys} en '{collection}': {e}")
+        
+        missing = []
+        for collection, keys in UNIQUE_INDEXES:
+            try:
+                self.db[collection].create_index(keys, unique=True)
+            except Exception as e:
+                print(f"Error creando índice único {keys} en '{collection}': {e}")
+                missing.append(f"{collection}.{keys[0][0]}")
+        if missing and require_unique:
+            raise RuntimeError(
+                f"Faltan índices únicos ({', '.join(missing)}); elimina los documentos duplicados "
+                f"(python migrate.py fusiona los carritos repetidos) y vuelve a iniciar"
+            )
+    
     def disconnect(self):
         """Desconectar de MongoDB"""
         if self.client:
             self.client.close()
             print("Desconectado de MongoDB")
     
+    def _invalidate_catalog(self, *object_ids):
+        """Invalidar la caché del catálogo (y la de los productos dados) tras una modificación de productos"""
+        self.catalog_cache.clear()
+        for object_id in object_ids:
+            self.cart_product_cache.invalidate(object_id)
+        # El contador vive en la base de datos: lo comparten todos los procesos y sobrevive a los reinicios
+        state = self.db[COLLECTION_METADATA].find_one_and_update(
+            {"_id": "catalog"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.catalog_version = (state["version"], time.monotonic())
+    
+    def get_catalog_version(self):
+        """Obtener la versión actual del catálogo para validar cachés de clientes"""
+        version, checked_at = self.catalog_version
+        # Se vuelve a leer como mucho una vez por TTL, para ver los cambios hechos por otros procesos
+        if checked_at is None or time.monotonic() - checked_at >= CATALOG_CACHE_TTL:
+            state = self.db[COLLECTION_METADATA].find_one({"_id": "catalog"}) or {}
+            latest = state.get("version", 0)
+            if version is not None and latest != version:
+                # Otro proceso modificó el catálogo: lo cacheado aquí ya no vale
+                self.catalog_cache.clear()
+            self.catalog_version = (latest, time.monotonic())
+            version = latest
+        return str(version)
+    
+    def get_cache_stats(self):
+        """Obtener métricas de las cachés en memoria"""
+        return {
+            "success": True,
+            "caches": {
+                "catalog": self.catalog_cache.stats(),
+                "roles": self.role_cache.stats(),
+                "cart_products": self.cart_product_cache.stats()
+            }
+        }
+    
     def add_user(self, username, password, role="usuario"):
         """Agregar un nuevo usuario con rol"""
         try:
-            # Verificar si el usuario ya existe
-            existing_user = self.db[COLLECTION_USERS].find_one({"username": username})
-            if existing_user:
-                return {"success": False, "message": "El usuario ya existe"}
-            
             # Validar rol
             valid_roles = ["usuario", "editor", "administrador"]
             if role not in valid_roles:
@@ -41,13 +266,18 @@ class DatabaseManager:
             # Crear nuevo usuario
             user_data = {
                 "username": username,
-                "password": password,
+                "password": hash_password(password),
                 "role": role,
                 "created_at": datetime.now(),
                 "is_active": True
             }
             
-            result = self.db[COLLECTION_USERS].insert_one(user_data)
+            # El índice único sobre username rechaza duplicados, también entre altas simultáneas
+            try:
+                result = self.db[COLLECTION_USERS].insert_one(user_data)
+            except DuplicateKeyError:
+                return {"success": False, "message": "El usuario ya existe", "error": "duplicate_user"}
+            self.role_cache.invalidate(username)
             
             if result.inserted_id:
                 return {
@@ -61,16 +291,85 @@ class DatabaseManager:
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
+    def add_users_bulk(self, users, chunk_size=BULK_CHUNK_SIZE):
+        """Agregar muchos usuarios con insert_many; los duplicados los detecta el índice único"""
+        try:
+            valid_roles = list(ROLE_HIERARCHY)
+            errors = []
+            candidates = []
+            
+            # Validar todas las filas antes de calcular ningún hash
+            for index, user in enumerate(users):
+                username = (user.get("username") or "").strip()
+                password = user.get("password") or ""
+                role = user.get("role") or "usuario"
+                if not username or not password:
+                    errors.append({"index": index, "username": username, "message": "Usuario y contraseña son obligatorios"})
+                elif role not in valid_roles:
+                    errors.append({"index": index, "username": username, "message": f"Rol inválido. Roles válidos: {', '.join(valid_roles)}"})
+                else:
+                    candidates.append((index, username, password, role))
+            
+            # Los hashes se calculan en el pool de altas masivas, no en el que atiende los logins
+            hashes = bulk_password_pool.map(hash_password, [password for _, _, password, _ in candidates])
+            now = datetime.now()
+            documents = [
+                {
+                    "username": username,
+                    "password": password_hash,
+                    "role": role,
+                    "created_at": now,
+                    "is_active": True
+                } for (_, username, _, role), password_hash in zip(candidates, hashes)
+            ]
+            
+            inserted = []
+            for start in range(0, len(documents), chunk_size):
+                chunk = documents[start:start + chunk_size]
+                failed = set()
+                try:
+                    self.db[COLLECTION_USERS].insert_many(chunk, ordered=False)
+                except BulkWriteError as e:
+                    for write_error in e.details.get("writeErrors", []):
+                        failed.add(write_error["index"])
+                        index, username, _, _ = candidates[start + write_error["index"]]
+                        message = "El usuario ya existe" if write_error.get("code") == 11000 else write_error.get("errmsg", "Error al crear el usuario")
+                        errors.append({"index": index, "username": username, "message": message})
+                
+                inserted.extend(document for offset, document in enumerate(chunk) if offset not in failed)
+            
+            for document in inserted:
+                self.role_cache.invalidate(document["username"])
+            
+            errors.sort(key=lambda error: error["index"])
+            return {
+                "success": True,
+                "message": f"{len(inserted)} usuarios creados, {len(errors)} con errores",
+                "inserted_count": len(inserted),
+                "user_ids": [str(document["_id"]) for document in inserted],
+                "errors": errors
+            }
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
     def get_user(self, username, password):
         """Obtener usuario por credenciales"""
         try:
             user = self.db[COLLECTION_USERS].find_one({
                 "username": username,
-                "password": password,
                 "is_active": True
             })
             
-            if user:
+            if user and verify_password(password, user.get("password")):
+                self.role_cache.set(username, (user.get("role", "usuario"), True))
+
+                # Rehash transparente de contraseñas en texto plano o con otro coste
+                if needs_rehash(user["password"]):
+                    self.db[COLLECTION_USERS].update_one(
+                        {"_id": user["_id"], "password": user["password"]},
+                        {"$set": {"password": hash_password(password)}}
+                    )
+                
                 return {
                     "success": True,
                     "user": {
@@ -81,33 +380,98 @@ class DatabaseManager:
                     }
                 }
             else:
+                if not user:
+                    # Mismo coste que con un usuario real: el tiempo de respuesta no revela si existe
+                    verify_password(password, dummy_hash())
                 return {"success": False, "message": "Credenciales incorrectas"}
                 
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
-    def get_all_users(self):
-        """Obtener todos los usuarios"""
+    def _serialize_user(self, user, fields):
+        """Convertir un documento de usuario al formato de la API"""
+        upgrade_document(COLLECTION_USERS, user)
+        serialized = {"id": str(user["_id"])}
+        for field in fields:
+            if field == "role":
+                serialized[field] = user.get("role", "usuario")
+            elif field == "is_active":
+                serialized[field] = user.get("is_active", True)
+            else:
+                serialized[field] = user.get(field)
+        return serialized
+    
+    def _find_page(self, collection, query, projection, limit=None, cursor=None):
+        """Leer una página ordenada por _id; devuelve (documentos, next_cursor) o None si el cursor no es válido"""
+        sort_spec = [("_id", 1)]
+        if cursor:
+            condition = self._keyset_condition(None, sort_spec, cursor)
+            if condition is None:
+                return None
+            query = {"$and": [query, condition]}
+        
+        find_cursor = self.db[collection].find(query, projection).sort(sort_spec)
+        if limit is not None:
+            # Pedir un elemento extra para saber si hay otra página
+            find_cursor = find_cursor.limit(limit + 1)
+        documents = list(find_cursor)
+        
+        next_cursor = None
+        if limit is not None and len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = self._page_cursor(None, sort_spec, documents[-1])
+        return documents, next_cursor
+    
+    def get_all_users(self, fields=None, limit=None, cursor=None):
+        """Obtener usuarios activos, paginados por _id si se indica un límite"""
         try:
-            users = list(self.db[COLLECTION_USERS].find({"is_active": True}))
+            error = invalid_fields_error(fields, USER_FIELDS)
+            if error:
+                return error
+            fields = tuple(fields or ("username", "created_at"))
+            
+            page = self._find_page(
+                COLLECTION_USERS,
+                {"is_active": True},
+                {field: 1 for field in fields},
+                limit,
+                cursor
+            )
+            if page is None:
+                return {"success": False, "message": "Cursor inválido", "error": "invalid_cursor"}
+            users, next_cursor = page
+            
             return {
                 "success": True,
-                "users": [
-                    {
-                        "id": str(user["_id"]),
-                        "username": user["username"],
-                        "created_at": user["created_at"]
-                    } for user in users
-                ]
+                "users": [self._serialize_user(user, fields) for user in users],
+                "next_cursor": next_cursor
             }
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
+    def get_user_stats(self):
+        """Contar usuarios activos por rol con una sola agregación"""
+        try:
+            counts = {role: 0 for role in ROLE_HIERARCHY}
+            pipeline = [
+                {"$match": {"is_active": True}},
+                {"$group": {"_id": {"$ifNull": ["$role", "usuario"]}, "count": {"$sum": 1}}}
+            ]
+            for group in self.db[COLLECTION_USERS].aggregate(pipeline):
+                counts[group["_id"]] = group["count"]
+            
+            return {"success": True, "total": sum(counts.values()), "roles": counts}
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
     def add_product(self, product_data):
         """Agregar un nuevo producto"""
         try:
-            product_data["created_at"] = datetime.now()
+            product_data["created_at"] = product_data["updated_at"] = datetime.now()
             result = self.db[COLLECTION_PRODUCTS].insert_one(product_data)
+            self._invalidate_catalog()
+            self.search_index.add(product_data)
+            self.facets.add(product_data)
             
             if result.inserted_id:
                 return {
@@ -121,29 +485,361 @@ class DatabaseManager:
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
-    def get_all_products(self):
-        """Obtener todos los productos"""
+    def add_products_bulk(self, products, chunk_size=BULK_CHUNK_SIZE):
+        """Agregar muchos productos con insert_many por lotes"""
         try:
-            products = list(self.db[COLLECTION_PRODUCTS].find())
+            now = datetime.now()
+            inserted = []
+            errors = []
+            
+            try:
+                for start in range(0, len(products), chunk_size):
+                    chunk = products[start:start + chunk_size]
+                    for product_data in chunk:
+                        product_data["created_at"] = product_data["updated_at"] = now
+                    
+                    failed = set()
+                    try:
+                        # insert_many asigna el _id de cada documento antes de enviarlo
+                        self.db[COLLECTION_PRODUCTS].insert_many(chunk, ordered=False)
+                    except BulkWriteError as e:
+                        for write_error in e.details.get("writeErrors", []):
+                            failed.add(write_error["index"])
+                            errors.append({
+                                "index": start + write_error["index"],
+                                "message": write_error.get("errmsg", "Error al insertar")
+                            })
+                    
+                    inserted.extend(
+                        product_data for offset, product_data in enumerate(chunk)
+                        if offset not in failed
+                    )
+            finally:
+                # Una sola invalidación para todo el lote, aunque falle a medias
+                self._invalidate_catalog()
+            
+            for product_data in inserted:
+                self.search_index.add(product_data)
+                self.facets.add(product_data)
+            
             return {
                 "success": True,
-                "products": [
-                    {
-                        "id": str(product["_id"]),
-                        "name": product["name"],
-                        "price": product["price"],
-                        "description": product["description"],
-                        "category": product["category"],
-                        "image": product["image"],
-                        "size": product["size"],
-                        "color": product["color"],
-                        "stock": product.get("stock", 0)
-                    } for product in products
-                ]
+                "message": f"{len(inserted)} productos creados, {len(errors)} con errores",
+                "inserted_count": len(inserted),
+                "inserted_ids": [str(product_data["_id"]) for product_data in inserted],
+                "errors": errors
             }
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
+    def _bulk_operation(self, operation, object_id, now):
+        """Convertir una operación masiva en una petición de bulk_write, o un mensaje de error"""
+        op = operation.get("op")
+        if op == "delete":
+            return DeleteOne({"_id": object_id}), None
+        
+        if op == "set":
+            fields = operation.get("fields") or {}
+            if not fields:
+                return None, "No se indicaron campos a modificar"
+            for field, value in fields.items():
+                expected = PRODUCT_FIELD_TYPES.get(field)
+                if expected is None:
+                    return None, f"Campo inválido: {field}"
+                if not isinstance(value, expected) or isinstance(value, bool):
+                    return None, f"Valor inválido para '{field}'"
+            return UpdateOne({"_id": object_id}, {"$set": dict(fields, updated_at=now)}), None
+        
+        if op == "adjust_price":
+            percent = operation.get("percent")
+            if not isinstance(percent, (int, float)) or isinstance(percent, bool) or percent <= -100:
+                return None, "Porcentaje inválido"
+            factor = 1 + percent / 100
+            # Actualización con pipeline: el nuevo precio se calcula en el servidor
+            return UpdateOne(
+                {"_id": object_id, "price": {"$type": "number"}},
+                [{"$set": {
+                    "price": {"$round": [{"$multiply": ["$price", factor]}, 2]},
+                    "updated_at": now
+                }}]
+            ), None
+        
+        return None, f"Operación inválida: {op}"
+    
+    def bulk_update_products(self, operations, chunk_size=BULK_CHUNK_SIZE):
+        """Modificar o eliminar muchos productos con bulk_write por lotes"""
+        try:
+            now = datetime.now()
+            requests = []
+            positions = []
+            object_ids = []
+            failures = []
+            reindex_ids = []
+            deleted_ids = []
+            
+            for position, operation in enumerate(operations):
+                object_id = to_object_id(operation.get("product_id"))
+                if object_id is None:
+                    failures.append({"index": position, "message": "ID de producto inválido"})
+                    continue
+                
+                request, error = self._bulk_operation(operation, object_id, now)
+                if error:
+                    failures.append({"index": position, "message": error})
+                    continue
+                
+                requests.append(request)
+                positions.append(position)
+                object_ids.append(object_id)
+                if operation["op"] == "delete":
+                    deleted_ids.append(object_id)
+                elif operation["op"] == "set" and set(operation["fields"]) & set(SEARCH_PROJECTION):
+                    reindex_ids.append(object_id)
+            
+            matched = modified = deleted = 0
+            try:
+                for start in range(0, len(requests), chunk_size):
+                    chunk = requests[start:start + chunk_size]
+                    try:
+                        result = self.db[COLLECTION_PRODUCTS].bulk_write(chunk, ordered=False)
+                        details = result.bulk_api_result
+                    except BulkWriteError as e:
+                        details = e.details
+                        for write_error in details.get("writeErrors", []):
+                            failures.append({
+                                "index": positions[start + write_error["index"]],
+                                "message": write_error.get("errmsg", "Error al modificar")
+                            })
+                    matched += details.get("nMatched", 0)
+                    modified += details.get("nModified", 0)
+                    deleted += details.get("nRemoved", 0)
+            finally:
+                # Una sola invalidación para todo el lote, aunque falle a medias
+                if requests:
+                    self._invalidate_catalog(*object_ids)
+                    # Los ajustes de precio se calculan en el servidor: las facetas se recalculan
+                    self.facets.invalidate()
+            
+            for object_id in deleted_ids:
+                self.search_index.remove(object_id)
+            if reindex_ids:
+                for product in self.db[COLLECTION_PRODUCTS].find({"_id": {"$in": reindex_ids}}, SEARCH_PROJECTION):
+                    self.search_index.add(product)
+            
+            failures.sort(key=lambda failure: failure["index"])
+            return {
+                "success": True,
+                "message": f"{matched} productos encontrados, {modified} modificados, {deleted} eliminados",
+                "matched_count": matched,
+                "modified_count": modified,
+                "deleted_count": deleted,
+                "failures": failures
+            }
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
+    def _serialize_product(self, product, fields=None):
+        """Convertir un documento de producto al formato de la API"""
+        upgrade_document(COLLECTION_PRODUCTS, product)
+        serialized = {"id": str(product["_id"])}
+        for field in fields or PRODUCT_FIELDS:
+            serialized[field] = product.get("stock", 0) if field == "stock" else product[field]
+        return serialized
+    
+    def _build_product_query(self, filters):
+        """Construir la consulta de MongoDB a partir de los filtros del catálogo"""
+        query = {}
+        for field in ("category", "size", "color"):
+            if filters.get(field) is not None:
+                query[field] = filters[field]
+        
+        price_range = {}
+        if filters.get("min_price") is not None:
+            price_range["$gte"] = filters["min_price"]
+        if filters.get("max_price") is not None:
+            price_range["$lte"] = filters["max_price"]
+        if price_range:
+            query["price"] = price_range
+        
+        if filters.get("in_stock"):
+            query["stock"] = {"$gt": 0}
+        
+        return query
+    
+    def _keyset_condition(self, sort, sort_spec, cursor):
+        """Construir la condición que continúa la paginación después del cursor"""
+        position = decode_cursor(cursor)
+        if not position or position.get("sort") != sort:
+            return None
+        
+        last_id = to_object_id(position.get("id"))
+        if last_id is None:
+            return None
+        
+        operator = "$gt" if sort_spec[-1][1] == 1 else "$lt"
+        if len(sort_spec) == 1:
+            return {"_id": {operator: last_id}}
+        
+        field = sort_spec[0][0]
+        value = position.get("value")
+        if field == "created_at":
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None
+        
+        return {"$or": [
+            {field: {operator: value}},
+            {field: value, "_id": {operator: last_id}}
+        ]}
+    
+    def _page_cursor(self, sort, sort_spec, document):
+        """Generar el cursor que apunta después del documento dado"""
+        position = {"sort": sort, "id": str(document["_id"])}
+        if len(sort_spec) > 1:
+            value = document.get(sort_spec[0][0])
+            position["value"] = value.isoformat() if isinstance(value, datetime) else value
+        return encode_cursor(position)
+    
+    def get_all_products(self, limit=None, cursor=None, filters=None, sort=None, fields=None):
+        """Obtener productos filtrados y ordenados, paginados si se indica un límite"""
+        try:
+            error = invalid_fields_error(fields, PRODUCT_FIELDS)
+            if error:
+                return error
+            fields = tuple(fields) if fields else None
+            
+            if sort not in PRODUCT_SORTS:
+                return {"success": False, "message": "Orden inválido", "error": "invalid_sort"}
+            sort_spec = PRODUCT_SORTS[sort]
+            
+            filters = {key: value for key, value in (filters or {}).items() if value is not None}
+            cache_key = ("products", limit, cursor, sort, fields, tuple(sorted(filters.items())))
+            page = self.catalog_cache.get(cache_key)
+            if page is not None:
+                return {"success": True, **page}
+            
+            query = self._build_product_query(filters)
+            if cursor:
+                condition = self._keyset_condition(sort, sort_spec, cursor)
+                if condition is None:
+                    return {"success": False, "message": "Cursor inválido", "error": "invalid_cursor"}
+                query = {"$and": [query, condition]} if query else condition
+            
+            # El campo de orden se proyecta siempre porque el cursor lo necesita
+            projection = {field: 1 for field in fields} if fields else dict(PRODUCT_PROJECTION)
+            projection.update({field: 1 for field, _ in sort_spec})
+            find_cursor = self.db[COLLECTION_PRODUCTS].find(query, projection).sort(sort_spec)
+            if limit is not None:
+                # Pedir un elemento extra para saber si hay otra página
+                find_cursor = find_cursor.limit(limit + 1)
+            documents = list(find_cursor)
+            
+            next_cursor = None
+            if limit is not None and len(documents) > limit:
+                documents = documents[:limit]
+                next_cursor = self._page_cursor(sort, sort_spec, documents[-1])
+            
+            page = {
+                "products": [self._serialize_product(product, fields) for product in documents],
+                "next_cursor": next_cursor
+            }
+            self.catalog_cache.set(cache_key, page)
+            return {"success": True, **page}
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
+    def get_product(self, product_id):
+        """Obtener un producto por ID"""
+        try:
+            object_id = to_object_id(product_id)
+            if object_id is None:
+                return {"success": False, "message": "ID de producto inválido", "error": "invalid_id"}
+            
+            cache_key = ("product", str(object_id))
+            product = self.catalog_cache.get(cache_key)
+            if product is None:
+                document = self.db[COLLECTION_PRODUCTS].find_one({"_id": object_id}, PRODUCT_PROJECTION)
+                if not document:
+                    return {"success": False, "message": "Producto no encontrado", "error": "not_found"}
+                product = self._serialize_product(document)
+                self.catalog_cache.set(cache_key, product)
+            
+            return {"success": True, "product": product}
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
+    def iter_products(self, batch_size):
+        """Recorrer todo el catálogo desde un cursor, sin cargarlo en memoria"""
+        cursor = self.db[COLLECTION_PRODUCTS].find({}, PRODUCT_PROJECTION, batch_size=batch_size).sort("_id", 1)
+        try:
+            for product in cursor:
+                yield self._serialize_product(product)
+        finally:
+            cursor.close()
+    
+    def _build_search_index(self):
+        """Leer el catálogo y sustituir el índice de búsqueda por uno nuevo"""
+        documents = self.db[COLLECTION_PRODUCTS].find({}, SEARCH_PROJECTION)
+        self.search_index.build(documents)
+    
+    def _rebuild_search_index(self):
+        """Reconstrucción en segundo plano; las búsquedas siguen con el índice anterior"""
+        try:
+            self._build_search_index()
+        except Exception as e:
+            print(f"Error reconstruyendo el índice de búsqueda: {e}")
+        finally:
+            self.search_index_build_lock.release()
+    
+    def _ensure_search_index(self):
+        """Construir el índice de búsqueda si no existe o renovarlo en segundo plano si es antiguo"""
+        if self.search_index.built_at is None:
+            # Primera búsqueda: no hay índice con el que responder, así que se espera a construirlo
+            with self.search_index_build_lock:
+                if self.search_index.built_at is None:
+                    self._build_search_index()
+        elif time.monotonic() - self.search_index.built_at > SEARCH_INDEX_MAX_AGE:
+            if self.search_index_build_lock.acquire(blocking=False):
+                threading.Thread(target=self._rebuild_search_index, name="search-index", daemon=True).start()
+    
+    def search_products(self, query, limit=20):
+        """Buscar productos por texto, ordenados por relevancia"""
+        try:
+            self._ensure_search_index()
+            ranked = self.search_index.search(query, limit)
+            if not ranked:
+                return {"success": True, "products": []}
+            
+            object_ids = [ObjectId(product_id) for product_id, _ in ranked]
+            documents = {
+                str(product["_id"]): product
+                for product in self.db[COLLECTION_PRODUCTS].find({"_id": {"$in": object_ids}}, PRODUCT_PROJECTION)
+            }
+            
+            products = []
+            for product_id, score in ranked:
+                if product_id in documents:
+                    product = self._serialize_product(documents[product_id])
+                    product["score"] = score
+                    products.append(product)
+            
+            return {"success": True, "products": products}
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
+    def get_product_facets(self):
+        """Obtener conteos por categoría, talla, color y rango de precio"""
+        try:
+            built_at = self.facets.built_at
+            if built_at is None or time.monotonic() - built_at > FACETS_MAX_AGE:
+                aggregation = next(self.db[COLLECTION_PRODUCTS].aggregate(facets_pipeline()), {})
+                self.facets.build(aggregation)
+            
+            return {"success": True, "facets": self.facets.snapshot()}
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
     def create_sample_data(self):
         """Crear datos de muestra"""
         try:
@@ -238,12 +934,19 @@ class DatabaseManager:
             # Agregar fecha de actualización
             product_data["updated_at"] = datetime.now()
             
-            result = self.db[COLLECTION_PRODUCTS].update_one(
+            previous = self.db[COLLECTION_PRODUCTS].find_one_and_update(
                 {"_id": object_id},
-                {"$set": product_data}
+                {"$set": product_data},
+                projection=INDEXED_PROJECTION,
+                return_document=ReturnDocument.BEFORE
             )
+            self._invalidate_catalog(object_id)
             
-            if result.modified_count > 0:
+            if previous:
+                product = dict(previous, **product_data)
+                self.search_index.add(product)
+                self.facets.remove(previous)
+                self.facets.add(product)
                 return {"success": True, "message": "Producto actualizado exitosamente"}
             else:
                 return {"success": False, "message": "Producto no encontrado"}
@@ -262,9 +965,15 @@ class DatabaseManager:
             except:
                 return {"success": False, "message": "ID de producto inválido"}
             
-            result = self.db[COLLECTION_PRODUCTS].delete_one({"_id": object_id})
+            product = self.db[COLLECTION_PRODUCTS].find_one_and_delete(
+                {"_id": object_id},
+                projection=INDEXED_PROJECTION
+            )
+            self._invalidate_catalog(object_id)
             
-            if result.deleted_count > 0:
+            if product:
+                self.search_index.remove(object_id)
+                self.facets.remove(product)
                 return {"success": True, "message": "Producto eliminado exitosamente"}
             else:
                 return {"success": False, "message": "Producto no encontrado"}
@@ -283,8 +992,10 @@ class DatabaseManager:
                 {"username": username},
                 {"$set": {"role": new_role, "updated_at": datetime.now()}}
             )
+            self.role_cache.invalidate(username)
             
             if result.modified_count > 0:
+                self.role_changes.revoke(username)
                 return {"success": True, "message": f"Rol de '{username}' actualizado a '{new_role}'"}
             else:
                 return {"success": False, "message": "Usuario no encontrado"}
@@ -292,28 +1003,40 @@ class DatabaseManager:
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
-    def get_users_by_role(self, role):
-        """Obtener usuarios por rol"""
+    def is_token_current(self, payload):
+        """Comprobar que el rol del token no ha cambiado desde que se emitió"""
+        return self.role_changes.is_current(payload)
+    
+    def get_users_by_role(self, role, fields=None, limit=None, cursor=None):
+        """Obtener usuarios por rol, paginados por _id si se indica un límite"""
         try:
+            error = invalid_fields_error(fields, USER_FIELDS)
+            if error:
+                return error
+            fields = tuple(fields or ("username", "role", "created_at"))
+            
             valid_roles = ["usuario", "editor", "administrador"]
             if role not in valid_roles:
                 return {"success": False, "message": f"Rol inválido. Roles válidos: {', '.join(valid_roles)}"}
             
-            users = list(self.db[COLLECTION_USERS].find(
+            page = self._find_page(
+                COLLECTION_USERS,
                 {"role": role, "is_active": True},
-                {"password": 0}  # Excluir contraseñas
-            ))
+                {field: 1 for field in fields},  # Nunca se proyecta la contraseña
+                limit,
+                cursor
+            )
+            if page is None:
+                return {"success": False, "message": "Cursor inválido", "error": "invalid_cursor"}
+            users, next_cursor = page
             
             user_list = []
             for user in users:
-                user_list.append({
-                    "id": str(user["_id"]),
-                    "username": user["username"],
-                    "role": user.get("role", "usuario"),
-                    "created_at": user["created_at"]
-                })
+                if "username" in user:
+                    self.role_cache.set(user["username"], (role, True))
+                user_list.append(self._serialize_user(user, fields))
             
-            return {"success": True, "users": user_list}
+            return {"success": True, "users": user_list, "next_cursor": next_cursor}
             
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
@@ -321,27 +1044,23 @@ class DatabaseManager:
     def check_permission(self, username, required_role):
         """Verificar si un usuario tiene el rol necesario"""
         try:
-            user = self.db[COLLECTION_USERS].find_one(
-                {"username": username, "is_active": True},
-                {"role": 1}
-            )
+            entry = self.role_cache.get(username)
+            if entry is None:
+                user = self.db[COLLECTION_USERS].find_one(
+                    {"username": username},
+                    {"role": 1, "is_active": 1}
+                )
+                if not user:
+                    return {"success": False, "message": "Usuario no encontrado"}
+                
+                entry = (user.get("role", "usuario"), user.get("is_active") is True)
+                self.role_cache.set(username, entry)
             
-            if not user:
+            user_role, is_active = entry
+            if not is_active:
                 return {"success": False, "message": "Usuario no encontrado"}
             
-            user_role = user.get("role", "usuario")
-            
-            # Definir jerarquía de roles
-            role_hierarchy = {
-                "usuario": 1,
-                "editor": 2,
-                "administrador": 3
-            }
-            
-            user_level = role_hierarchy.get(user_role, 1)
-            required_level = role_hierarchy.get(required_role, 1)
-            
-            if user_level >= required_level:
+            if has_role(user_role, required_role):
                 return {"success": True, "message": "Permiso concedido"}
             else:
                 return {"success": False, "message": f"Permiso denegado. Se requiere rol '{required_role}' o superior"}
@@ -351,20 +1070,42 @@ class DatabaseManager:
     
     # ==================== MÉTODOS DEL CARRITO ====================
     
+    def _get_cart_products(self, object_ids):
+        """Obtener los datos que el carrito copia de cada producto, leyendo de MongoDB sólo los que no están en caché"""
+        products = {}
+        missing = []
+        for object_id in object_ids:
+            product = self.cart_product_cache.get(object_id)
+            if product is None:
+                missing.append(object_id)
+            else:
+                products[object_id] = product
+        
+        if missing:
+            for product in self.db[COLLECTION_PRODUCTS].find({"_id": {"$in": missing}}, CART_PRODUCT_PROJECTION):
+                upgrade_document(COLLECTION_PRODUCTS, product)
+                self.cart_product_cache.set(product["_id"], product)
+                products[product["_id"]] = product
+        
+        return products
+    
     def add_to_cart(self, user_id, product_id, size="M", quantity=1):
         """Agregar producto al carrito del usuario"""
         try:
-            from bson import ObjectId
+            object_id = to_object_id(product_id)
+            if object_id is None:
+                return {"success": False, "message": "ID de producto inválido"}
+            # Forma canónica (hex en minúsculas), la misma que guarda add_many_to_cart
+            product_id = str(object_id)
             
             # Obtener información del producto
-            product = self.db[COLLECTION_PRODUCTS].find_one({"_id": ObjectId(product_id)})
+            product = self._get_cart_products([object_id]).get(object_id)
             if not product:
                 return {"success": False, "message": "Producto no encontrado"}
             
-            # Buscar carrito existente del usuario
-            cart = self.db[COLLECTION_CART].find_one({"user_id": user_id})
-            
-            # Crear item del carrito
+            now = datetime.now()
+            item_filter = {"product_id": product_id, "size": size}
+            totals = {"total_items": quantity, "total_price": product["price"] * quantity}
             cart_item = {
                 "product_id": product_id,
                 "product_name": product["name"],
@@ -372,67 +1113,161 @@ class DatabaseManager:
                 "product_image": product["image"],
                 "size": size,
                 "quantity": quantity,
-                "added_at": datetime.now()
+                "added_at": now
             }
             
-            if cart:
-                # Verificar si el producto ya existe en el carrito con la misma talla
-                existing_item = None
-                for item in cart["items"]:
-                    if item["product_id"] == product_id and item["size"] == size:
-                        existing_item = item
-                        break
-                
-                if existing_item:
-                    # Actualizar cantidad del item existente
-                    existing_item["quantity"] += quantity
-                else:
-                    # Agregar nuevo item
-                    cart["items"].append(cart_item)
-                
-                # Recalcular totales
-                cart["total_items"] = sum(item["quantity"] for item in cart["items"])
-                cart["total_price"] = sum(item["product_price"] * item["quantity"] for item in cart["items"])
-                cart["updated_at"] = datetime.now()
-                
-                # Actualizar en la base de datos
+            # Un segundo intento cubre la creación simultánea del mismo carrito
+            for _ in range(2):
+                # Item ya presente con el mismo precio: se incrementa en el sitio junto con los totales
                 result = self.db[COLLECTION_CART].update_one(
-                    {"_id": cart["_id"]},
-                    {"$set": cart}
+                    {"user_id": user_id, "items": {"$elemMatch": dict(item_filter, product_price=product["price"])}},
+                    {"$inc": dict(totals, **{"items.$.quantity": quantity}), "$set": {"updated_at": now}}
                 )
-                
-                if result.modified_count > 0:
+                if result.matched_count:
                     return {"success": True, "message": "Producto agregado al carrito"}
-                else:
-                    return {"success": False, "message": "Error al actualizar el carrito"}
-            else:
-                # Crear nuevo carrito
-                new_cart = {
-                    "user_id": user_id,
-                    "items": [cart_item],
-                    "total_items": quantity,
-                    "total_price": product["price"] * quantity,
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                }
                 
-                result = self.db[COLLECTION_CART].insert_one(new_cart)
+                # Item nuevo: se agrega al carrito existente o se crea el carrito (upsert)
+                try:
+                    self.db[COLLECTION_CART].update_one(
+                        {"user_id": user_id, "items": {"$not": {"$elemMatch": item_filter}}},
+                        {
+                            "$push": {"items": cart_item},
+                            "$inc": totals,
+                            "$set": {"updated_at": now},
+                            "$setOnInsert": {"created_at": now}
+                        },
+                        upsert=True
+                    )
+                    return {"success": True, "message": "Producto agregado al carrito"}
+                except DuplicateKeyError:
+                    # El carrito existe y ya contiene el item, o lo acaba de crear otra petición
+                    pass
                 
-                if result.inserted_id:
+                # Item presente con un precio anterior: conserva su precio y los totales se recalculan
+                cart = self._update_cart_items(user_id, [product_id], size, {"$map": {
+                    "input": "$items",
+                    "in": {"$cond": [
+                        cart_item_matches([product_id], size),
+                        {"$mergeObjects": ["$$this", {"quantity": {"$add": ["$$this.quantity", quantity]}}]},
+                        "$$this"
+                    ]}
+                }})
+                if cart:
                     return {"success": True, "message": "Producto agregado al carrito"}
-                else:
-                    return {"success": False, "message": "Error al crear el carrito"}
+            
+            return {"success": False, "message": "Error al actualizar el carrito"}
                     
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
-    def get_cart(self, user_id):
-        """Obtener carrito del usuario"""
+    def add_many_to_cart(self, user_id, items):
+        """Agregar varios productos al carrito con una consulta de productos y una actualización atómica"""
+        try:
+            if not items:
+                return {"success": False, "message": "No se indicaron productos", "error": "invalid_quantity"}
+            
+            # Agrupar por producto y talla; cada producto se consulta una sola vez
+            quantities = {}
+            for item in items:
+                object_id = to_object_id(item["product_id"])
+                if object_id is None:
+                    return {"success": False, "message": f"ID de producto inválido: {item['product_id']}", "error": "invalid_id"}
+                if item["quantity"] <= 0:
+                    return {"success": False, "message": f"Cantidad inválida para {item['product_id']}", "error": "invalid_quantity"}
+                key = (object_id, item["size"])
+                quantities[key] = quantities.get(key, 0) + item["quantity"]
+            
+            object_ids = list({object_id for object_id, _ in quantities})
+            products = self._get_cart_products(object_ids)
+            missing = [str(object_id) for object_id in object_ids if object_id not in products]
+            if missing:
+                return {"success": False, "message": f"Productos no encontrados: {', '.join(missing)}", "error": "not_found"}
+            
+            now = datetime.now()
+            new_items = [
+                {
+                    "product_id": str(object_id),
+                    "product_name": products[object_id]["name"],
+                    "product_price": products[object_id]["price"],
+                    "product_image": products[object_id]["image"],
+                    "size": size,
+                    "quantity": quantity,
+                    "added_at": now
+                } for (object_id, size), quantity in quantities.items()
+            ]
+            
+            # Cada item nuevo suma su cantidad al existente (que conserva su precio) o se añade al final
+            merged_items = {"$reduce": {
+                "input": {"$literal": new_items},
+                "initialValue": {"$ifNull": ["$items", []]},
+                "in": {"$cond": [
+                    {"$in": [
+                        ["$$this.product_id", "$$this.size"],
+                        {"$map": {"input": "$$value", "as": "item", "in": ["$$item.product_id", "$$item.size"]}}
+                    ]},
+                    {"$map": {"input": "$$value", "as": "item", "in": {"$cond": [
+                        {"$and": [
+                            {"$eq": ["$$item.product_id", "$$this.product_id"]},
+                            {"$eq": ["$$item.size", "$$this.size"]}
+                        ]},
+                        {"$mergeObjects": ["$$item", {"quantity": {"$add": ["$$item.quantity", "$$this.quantity"]}}]},
+                        "$$item"
+                    ]}}},
+                    {"$concatArrays": ["$$value", ["$$this"]]}
+                ]}
+            }}
+            
+            # Un segundo intento cubre la creación simultánea del mismo carrito
+            for attempt in range(2):
+                try:
+                    self.db[COLLECTION_CART].update_one(
+                        {"user_id": user_id},
+                        [
+                            {"$set": {"items": merged_items, "created_at": {"$ifNull": ["$created_at", now]}}},
+                            {"$set": dict(CART_TOTALS, updated_at=now)}
+                        ],
+                        upsert=True
+                    )
+                    break
+                except DuplicateKeyError:
+                    if attempt:
+                        raise
+            
+            return {
+                "success": True,
+                "message": f"{len(new_items)} productos agregados al carrito",
+                "added": len(new_items)
+            }
+            
+        except Exception as e:
+            return {"success": False, "message": f"Error: {str(e)}"}
+    
+    def _update_cart_items(self, user_id, product_ids, size, items):
+        """Reescribir los items de un carrito que contiene el item dado y recalcular sus totales en una sola operación"""
+        return self.db[COLLECTION_CART].find_one_and_update(
+            {"user_id": user_id, "items": {"$elemMatch": {"product_id": {"$in": product_ids}, "size": size}}},
+            [
+                {"$set": {"items": items}},
+                {"$set": dict(CART_TOTALS, updated_at=datetime.now())}
+            ],
+            projection={"total_items": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    def _cart_item_not_found(self, user_id):
+        """Respuesta de error cuando un item no está en el carrito (o no hay carrito)"""
+        if self.db[COLLECTION_CART].count_documents({"user_id": user_id}, limit=1):
+            return {"success": False, "message": "Item no encontrado en el carrito"}
+        return {"success": False, "message": "Carrito no encontrado"}
+    
+    def get_cart(self, user_id, refresh=False):
+        """Obtener carrito del usuario; con refresh se revalidan precios y stock contra el catálogo"""
         try:
             cart = self.db[COLLECTION_CART].find_one({"user_id": user_id})
             
             if cart:
-                return {
+                upgrade_document(COLLECTION_CART, cart)
+                result = {
                     "success": True,
                     "cart": {
                         "id": str(cart["_id"]),
@@ -444,6 +1279,9 @@ class DatabaseManager:
                         "updated_at": cart["updated_at"]
                     }
                 }
+                if refresh:
+                    self._refresh_cart(result["cart"])
+                return result
             else:
                 return {
                     "success": True,
@@ -461,45 +1299,61 @@ class DatabaseManager:
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
     
+    def _refresh_cart(self, cart):
+        """Añadir a cada item su precio y stock actuales (una sola consulta $in) y recalcular los totales"""
+        object_ids = {item["product_id"]: to_object_id(item["product_id"]) for item in cart["items"]}
+        products = {}
+        for product in self.db[COLLECTION_PRODUCTS].find(
+            {"_id": {"$in": [object_id for object_id in object_ids.values() if object_id]}},
+            {"price": 1, "stock": 1}
+        ):
+            upgrade_document(COLLECTION_PRODUCTS, product)
+            products[product["_id"]] = product
+        
+        total_items = 0
+        total_price = 0
+        has_changes = False
+        for item in cart["items"]:
+            product = products.get(object_ids[item["product_id"]])
+            stock = product.get("stock", 0) if product else 0
+            item["available"] = product is not None
+            item["current_price"] = product["price"] if product else None
+            item["price_changed"] = product is not None and product["price"] != item["product_price"]
+            item["available_stock"] = stock
+            item["in_stock"] = stock >= item["quantity"]
+            item["purchasable_quantity"] = max(0, min(item["quantity"], stock))
+            
+            # Los totales sólo cuentan lo que se puede comprar ahora (hasta el stock), al precio actual
+            if item["available"]:
+                total_items += item["purchasable_quantity"]
+                total_price += product["price"] * item["purchasable_quantity"]
+            has_changes = has_changes or item["price_changed"] or not item["in_stock"]
+        
+        cart["total_items"] = total_items
+        cart["total_price"] = round(total_price, 2)
+        cart["has_changes"] = has_changes
+        cart["refreshed"] = True
+    
     def update_cart_item_quantity(self, user_id, product_id, size, new_quantity):
         """Actualizar cantidad de un item en el carrito"""
         try:
-            from bson import ObjectId
+            # Eliminar item si cantidad es 0 o menor
+            if new_quantity <= 0:
+                return self.remove_from_cart(user_id, product_id, size)
             
-            cart = self.db[COLLECTION_CART].find_one({"user_id": user_id})
+            product_ids = cart_product_ids(product_id)
+            cart = self._update_cart_items(user_id, product_ids, size, {"$map": {
+                "input": "$items",
+                "in": {"$cond": [
+                    cart_item_matches(product_ids, size),
+                    {"$mergeObjects": ["$$this", {"quantity": new_quantity}]},
+                    "$$this"
+                ]}
+            }})
             if not cart:
-                return {"success": False, "message": "Carrito no encontrado"}
+                return self._cart_item_not_found(user_id)
             
-            # Buscar y actualizar el item
-            item_found = False
-            for item in cart["items"]:
-                if item["product_id"] == product_id and item["size"] == size:
-                    if new_quantity <= 0:
-                        # Eliminar item si cantidad es 0 o menor
-                        cart["items"].remove(item)
-                    else:
-                        item["quantity"] = new_quantity
-                    item_found = True
-                    break
-            
-            if not item_found:
-                return {"success": False, "message": "Item no encontrado en el carrito"}
-            
-            # Recalcular totales
-            cart["total_items"] = sum(item["quantity"] for item in cart["items"])
-            cart["total_price"] = sum(item["product_price"] * item["quantity"] for item in cart["items"])
-            cart["updated_at"] = datetime.now()
-            
-            # Actualizar en la base de datos
-            result = self.db[COLLECTION_CART].update_one(
-                {"_id": cart["_id"]},
-                {"$set": cart}
-            )
-            
-            if result.modified_count > 0:
-                return {"success": True, "message": "Cantidad actualizada"}
-            else:
-                return {"success": False, "message": "Error al actualizar el carrito"}
+            return {"success": True, "message": "Cantidad actualizada"}
                 
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
@@ -507,48 +1361,24 @@ class DatabaseManager:
     def remove_from_cart(self, user_id, product_id, size):
         """Eliminar producto del carrito"""
         try:
-            cart = self.db[COLLECTION_CART].find_one({"user_id": user_id})
+            product_ids = cart_product_ids(product_id)
+            cart = self._update_cart_items(user_id, product_ids, size, {"$filter": {
+                "input": "$items",
+                "cond": {"$not": [cart_item_matches(product_ids, size)]}
+            }})
             if not cart:
-                return {"success": False, "message": "Carrito no encontrado"}
-            
-            # Buscar y eliminar el item
-            item_found = False
-            for item in cart["items"]:
-                if item["product_id"] == product_id and item["size"] == size:
-                    cart["items"].remove(item)
-                    item_found = True
-                    break
-            
-            if not item_found:
-                return {"success": False, "message": "Item no encontrado en el carrito"}
+                return self._cart_item_not_found(user_id)
             
-            # Recalcular totales
-            cart["total_items"] = sum(item["quantity"] for item in cart["items"])
-            cart["total_price"] = sum(item["product_price"] * item["quantity"] for item in cart["items"])
-            cart["updated_at"] = datetime.now()
+            # Si no hay items, eliminar el carrito (sólo si sigue vacío)
+            if cart["total_items"] == 0:
+                self.db[COLLECTION_CART].delete_one({"_id": cart["_id"], "items": {"$size": 0}})
+                return {
+                    "success": True, 
+                    "message": "Producto eliminado del carrito",
+                    "cart_cleared": True
+                }
             
-            # Si no hay items, eliminar el carrito
-            if not cart["items"]:
-                result = self.db[COLLECTION_CART].delete_one({"_id": cart["_id"]})
-                if result.deleted_count > 0:
-                    return {
-                        "success": True, 
-                        "message": "Producto eliminado del carrito",
-                        "cart_cleared": True
-                    }
-                else:
-                    return {"success": False, "message": "Error al eliminar el carrito"}
-            else:
-                # Actualizar carrito
-                result = self.db[COLLECTION_CART].update_one(
-                    {"_id": cart["_id"]},
-                    {"$set": cart}
-                )
-                
-                if result.modified_count > 0:
-                    return {"success": True, "message": "Producto eliminado del carrito"}
-                else:
-                    return {"success": False, "message": "Error al actualizar el carrito"}
+            return {"success": True, "message": "Producto eliminado del carrito"}
                 
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
@@ -588,7 +1418,10 @@ class DatabaseManager:
             # Si el stock queda en 0 o menos, eliminar el producto
             if new_stock <= 0:
                 result = self.db[COLLECTION_PRODUCTS].delete_one({"_id": object_id})
+                self._invalidate_catalog(object_id)
                 if result.deleted_count > 0:
+                    self.search_index.remove(object_id)
+                    self.facets.remove(product)
                     return {
                         "success": True, 
                         "message": f"Producto '{product['name']}' eliminado por falta de stock",
@@ -602,6 +1435,7 @@ class DatabaseManager:
                     {"_id": object_id},
                     {"$set": {"stock": new_stock, "updated_at": datetime.now()}}
                 )
+                self._invalidate_catalog(object_id)
                 
                 if result.modified_count > 0:
                     return {
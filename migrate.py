@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Script para aplicar las migraciones de esquema pendientes
+Uso: python migrate.py [--status] [--only NOMBRE] [--batch-size N] [--sleep SEGUNDOS] [--dry-run] [--restart]
+"""
+
+from database_manager import DatabaseManager
+from schema_migrations import MigrationRunner, MIGRATIONS, get_migration
+import argparse
+import logging
+import sys
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones de esquema versionadas")
+    parser.add_argument("--status", action="store_true", help="Mostrar el estado de cada migración")
+    parser.add_argument("--only", help="Ejecutar sólo la migración indicada")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documentos por lote")
+    parser.add_argument("--sleep", type=float, default=0.1, help="Pausa en segundos entre lotes")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo contar los documentos pendientes")
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint guardado (requiere --only)")
+    args = parser.parse_args()
+
+    if args.restart and not args.only:
+        parser.error("--restart requiere --only")
+
+    migrations = MIGRATIONS
+    if args.only:
+        migration = get_migration(args.only)
+        if migration is None:
+            parser.error(f"Migración desconocida: {args.only}")
+        migrations = [migration]
+
+    print("=== MIGRACIONES DE ESQUEMA ===")
+    # Sin exigir los índices únicos: las migraciones son las que resuelven los duplicados
+    db_manager = DatabaseManager(require_unique_indexes=False)
+    try:
+        runner = MigrationRunner(db_manager.db, args.batch_size, args.sleep)
+
+        if args.status:
+            for state in runner.status():
+                print(f"{state['version']:03d} {state['name']}: {state['status']} ({state['migrated']} migrados)")
+            return
+
+        for migration in migrations:
+            runner.run(migration, dry_run=args.dry_run, restart=args.restart)
+
+        if args.dry_run:
+            print("\n✅ Simulación completada: no se modificó ningún documento")
+        else:
+            print("\n✅ Migraciones aplicadas")
+    except Exception as e:
+        print(f"\n❌ Error durante la migración: {str(e)}")
+        print("Verifica la conexión a MongoDB y las credenciales")
+        # Código de salida distinto de cero: los scripts de despliegue no deben seguir adelante
+        sys.exit(1)
+    finally:
+        db_manager.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 """
 Script para migrar usuarios existentes y agregar el campo de rol
-Uso: python migrate_roles.py
+Uso: python migrate_roles.py [--batch-size N] [--sleep SEGUNDOS] [--dry-run] [--restart]
 """
 
 from database_manager import DatabaseManager
+from schema_migrations import MigrationRunner, get_migration
+import argparse
 import logging
 
 # Configurar logging
@@ -14,74 +16,61 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def migrate_users_to_roles():
+def assign_default_roles(db_manager, batch_size=1000, sleep=0.1, dry_run=False, restart=False):
+    """Asignar el rol "usuario" a los usuarios sin rol, por lotes y con checkpoint"""
+    runner = MigrationRunner(db_manager.db, batch_size, sleep)
+    processed = runner.run(get_migration("users_default_role"), dry_run=dry_run, restart=restart)
+    if dry_run:
+        logger.info("Modo --dry-run: no se modifica ningún documento")
+    return processed
+
+def migrate_users_to_roles(batch_size=1000, sleep=0.1, dry_run=False, restart=False):
     """Migrar usuarios existentes para incluir roles"""
     try:
         db_manager = DatabaseManager()
         
-        # Obtener todos los usuarios sin rol
-        users_without_role = list(db_manager.db[db_manager.COLLECTION_USERS].find(
-            {"role": {"$exists": False}}
-        ))
-        
-        logger.info(f"Encontrados {len(users_without_role)} usuarios sin rol")
+        assign_default_roles(db_manager, batch_size, sleep, dry_run, restart)
         
-        # Asignar rol "usuario" por defecto a usuarios existentes
-        for user in users_without_role:
-            result = db_manager.db[db_manager.COLLECTION_USERS].update_one(
-                {"_id": user["_id"]},
-                {"$set": {"role": "usuario"}}
-            )
+        if not dry_run:
+            # Crear usuarios de ejemplo con diferentes roles
+            sample_users = [
+                {"username": "admin@tienda.com", "password": "admin123", "role": "administrador"},
+                {"username": "editor@tienda.com", "password": "editor123", "role": "editor"},
+                {"username": "usuario@tienda.com", "password": "usuario123", "role": "usuario"}
+            ]
             
-            if result.modified_count > 0:
-                logger.info(f"Usuario '{user['username']}' actualizado con rol 'usuario'")
-            else:
-                logger.warning(f"No se pudo actualizar usuario '{user['username']}'")
-        
-        # Crear usuarios de ejemplo con diferentes roles
-        sample_users = [
-            {"username": "admin@tienda.com", "password": "admin123", "role": "administrador"},
-            {"username": "editor@tienda.com", "password": "editor123", "role": "editor"},
-            {"username": "usuario@tienda.com", "password": "usuario123", "role": "usuario"}
-        ]
-        
-        logger.info("Creando usuarios de ejemplo con diferentes roles...")
-        
-        for user_data in sample_users:
-            # Verificar si el usuario ya existe
-            existing_user = db_manager.db[db_manager.COLLECTION_USERS].find_one(
-                {"username": user_data["username"]}
-            )
+            logger.info("Creando usuarios de ejemplo con diferentes roles...")
             
-            if not existing_user:
+            for user_data in sample_users:
+                # Insertar directamente; si ya existe, el índice único lo indica
                 result = db_manager.add_user(
                     user_data["username"], 
                     user_data["password"], 
                     user_data["role"]
                 )
-                logger.info(f"Usuario '{user_data['username']}' creado: {result['message']}")
-            else:
-                # Actualizar rol si ya existe
-                result = db_manager.update_user_role(
-                    user_data["username"], 
-                    user_data["role"]
-                )
-                logger.info(f"Usuario '{user_data['username']}' actualizado: {result['message']}")
+                
+                if result.get("error") != "duplicate_user":
+                    logger.info(f"Usuario '{user_data['username']}' creado: {result['message']}")
+                else:
+                    # Actualizar rol si ya existe
+                    result = db_manager.update_user_role(
+                        user_data["username"], 
+                        user_data["role"]
+                    )
+                    logger.info(f"Usuario '{user_data['username']}' actualizado: {result['message']}")
         
         # Mostrar resumen de usuarios por rol
         logger.info("\n=== RESUMEN DE USUARIOS POR ROL ===")
         
-        for role in ["usuario", "editor", "administrador"]:
-            result = db_manager.get_users_by_role(role)
-            if result["success"]:
-                count = len(result["users"])
+        result = db_manager.get_user_stats()
+        if result["success"]:
+            for role, count in result["roles"].items():
                 logger.info(f"{role.capitalize()}: {count} usuarios")
-                for user in result["users"]:
-                    logger.info(f"  - {user['username']}")
-            else:
-                logger.error(f"Error obteniendo usuarios de rol '{role}': {result['message']}")
+        else:
+            logger.error(f"Error obteniendo el resumen por rol: {result['message']}")
         
-        logger.info("\nMigración completada exitosamente!")
+        if not dry_run:
+            logger.info("\nMigración completada exitosamente!")
         
     except Exception as e:
         logger.error(f"Error durante la migración: {str(e)}")
@@ -91,18 +80,28 @@ def migrate_users_to_roles():
             db_manager.disconnect()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migración de roles de usuarios")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Usuarios por lote")
+    parser.add_argument("--sleep", type=float, default=0.1, help="Pausa en segundos entre lotes")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo contar los usuarios pendientes")
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint guardado")
+    args = parser.parse_args()
+    
     print("=== MIGRACIÓN DE ROLES DE USUARIOS ===")
     print("Este script migrará usuarios existentes y creará usuarios de ejemplo")
     print("con diferentes roles: usuario, editor, administrador")
     print()
     
     try:
-        migrate_users_to_roles()
-        print("\n✅ Migración completada exitosamente!")
-        print("\nUsuarios de ejemplo creados:")
-        print("- admin@tienda.com / admin123 (administrador)")
-        print("- editor@tienda.com / editor123 (editor)")
-        print("- usuario@tienda.com / usuario123 (usuario)")
+        migrate_users_to_roles(args.batch_size, args.sleep, args.dry_run, args.restart)
+        if args.dry_run:
+            print("\n✅ Simulación completada: no se modificó ningún documento")
+        else:
+            print("\n✅ Migración completada exitosamente!")
+            print("\nUsuarios de ejemplo creados:")
+            print("- admin@tienda.com / admin123 (administrador)")
+            print("- editor@tienda.com / editor123 (editor)")
+            print("- usuario@tienda.com / usuario123 (usuario)")
         
     except Exception as e:
         print(f"\n❌ Error durante la migración: {str(e)}")
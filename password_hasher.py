@@ -0,0 +1,71 @@
+"""
+Hash de contraseñas con PBKDF2-SHA256 y verificación fuera del event loop
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from config import PASSWORD_HASH_ITERATIONS, PASSWORD_HASH_WORKERS, BULK_PASSWORD_HASH_WORKERS
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import secrets
+
+ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+# Pool acotado para el trabajo de CPU del hash; hashlib libera el GIL durante PBKDF2
+password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+# Pool aparte para las altas masivas: un lote grande no deja en cola los logins
+bulk_password_pool = ThreadPoolExecutor(max_workers=BULK_PASSWORD_HASH_WORKERS, thread_name_prefix="password-bulk")
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+def hash_password(password, iterations=PASSWORD_HASH_ITERATIONS):
+    """Generar el hash almacenable de una contraseña ("pbkdf2_sha256$iteraciones$sal$hash")"""
+    salt = os.urandom(SALT_BYTES)
+    digest = _pbkdf2(password, salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+def is_hashed(stored):
+    """Indicar si el valor guardado es un hash y no una contraseña en texto plano"""
+    return isinstance(stored, str) and stored.startswith(f"{ALGORITHM}$")
+
+def verify_password(password, stored):
+    """Comprobar una contraseña contra el hash guardado (o contra texto plano heredado)"""
+    if not isinstance(stored, str):
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        expected = base64.b64decode(digest)
+        actual = _pbkdf2(password, base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+@functools.lru_cache(maxsize=None)
+def dummy_hash(iterations=PASSWORD_HASH_ITERATIONS):
+    """Hash fijo con el coste configurado, para verificar usuarios inexistentes en el mismo tiempo"""
+    return hash_password(secrets.token_hex(16), iterations)
+
+def needs_rehash(stored, iterations=PASSWORD_HASH_ITERATIONS):
+    """Indicar si el valor guardado debe regenerarse (texto plano o coste distinto)"""
+    if not is_hashed(stored):
+        return True
+    try:
+        return int(stored.split("$")[1]) != iterations
+    except (IndexError, ValueError):
+        return True
+
+async def run_in_pool(func, *args):
+    """Ejecutar una función bloqueante en el pool de contraseñas sin detener el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, functools.partial(func, *args))
@@ -0,0 +1,44 @@
+"""
+Limitador de peticiones en memoria con token buckets por clave y expulsión LRU
+"""
+
+from collections import OrderedDict
+import math
+import threading
+import time
+
+class TokenBucketLimiter:
+    def __init__(self, capacity, refill_per_minute, max_keys):
+        self.capacity = capacity
+        self.refill_rate = refill_per_minute / 60.0
+        self.max_keys = max_keys
+        # clave -> (tokens disponibles, instante de la última recarga)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Consumir un token; devuelve 0 si se permite o los segundos a esperar si no"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            elif self.refill_rate > 0:
+                retry_after = math.ceil((1 - tokens) / self.refill_rate)
+            else:
+                retry_after = 60
+
+            # Reinsertar al final mantiene el orden LRU; se expulsa la clave menos reciente
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            return retry_after
+
+    def reset(self, key):
+        """Olvidar el historial de una clave"""
+        with self._lock:
+            self._buckets.pop(key, None)
@@ -0,0 +1,273 @@
+"""
+Migraciones de esquema versionadas: ejecución por lotes con checkpoint y actualización perezosa al leer
+"""
+
+from config import COLLECTION_USERS, COLLECTION_PRODUCTS, COLLECTION_CART, COLLECTION_MIGRATIONS
+from pymongo import UpdateOne
+from datetime import datetime
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+class Migration:
+    def __init__(self, version, name, collection, query, needs_upgrade, upgrade, fields=()):
+        self.version = version
+        self.name = name
+        self.collection = collection
+        # Consulta de MongoDB que encuentra los documentos pendientes
+        self.query = query
+        # Versión en Python de la consulta, para aplicar la migración al leer
+        self.needs_upgrade = needs_upgrade
+        # Campos a fijar ($set) en un documento pendiente; {} si no se puede migrar
+        self.upgrade = upgrade
+        # Campos que lee `upgrade`: el runner sólo proyecta estos (y _id)
+        self.projection = dict({field: 1 for field in fields}, _id=1)
+
+class ScriptMigration:
+    def __init__(self, version, name, collection, apply):
+        self.version = version
+        self.name = name
+        self.collection = collection
+        # apply(colección, batch_size, sleep, dry_run) -> documentos procesados (o pendientes con dry_run)
+        self.apply = apply
+
+def _normalize_price(document):
+    try:
+        return {"price": round(float(str(document["price"]).replace(",", ".")), 2)}
+    except (KeyError, ValueError):
+        return {}
+
+def _merge_cart_items(items):
+    """Unir los items con el mismo producto y talla: suman sus cantidades y conservan el primer precio"""
+    merged = {}
+    for item in items:
+        key = (item["product_id"], item["size"])
+        if key in merged:
+            merged[key]["quantity"] += item["quantity"]
+        else:
+            merged[key] = dict(item)
+    return list(merged.values())
+
+def _cart_totals(items):
+    return {
+        "total_items": sum(item["quantity"] for item in items),
+        "total_price": sum(item["product_price"] * item["quantity"] for item in items)
+    }
+
+def _merge_duplicate_carts(collection, batch_size, sleep, dry_run):
+    """Fusionar los carritos repetidos de cada usuario en el más antiguo y crear el índice único"""
+    groups = list(collection.aggregate([
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True))
+    logger.info(f"{len(groups)} usuarios con carritos repetidos")
+    if dry_run:
+        return len(groups)
+
+    for start in range(0, len(groups), batch_size):
+        batch = groups[start:start + batch_size]
+        carts_by_user = {}
+        ids = [cart_id for group in batch for cart_id in group["ids"]]
+        for cart in collection.find({"_id": {"$in": ids}}).sort("_id", 1):
+            carts_by_user.setdefault(cart["user_id"], []).append(cart)
+
+        for carts in carts_by_user.values():
+            # Un mismo producto y talla suma sus cantidades y conserva el precio del carrito más antiguo
+            items = _merge_cart_items(item for cart in carts for item in cart.get("items", []))
+            collection.update_one({"_id": carts[0]["_id"]}, {"$set": dict(
+                _cart_totals(items),
+                items=items,
+                updated_at=datetime.now()
+            )})
+            collection.delete_many({"_id": {"$in": [cart["_id"] for cart in carts[1:]]}})
+
+        logger.info(f"Progreso: {min(start + batch_size, len(groups))}/{len(groups)} usuarios fusionados")
+        if sleep:
+            time.sleep(sleep)
+
+    collection.create_index([("user_id", 1)], unique=True)
+    return len(groups)
+
+# ObjectId en hexadecimal con alguna mayúscula: la forma canónica del carrito es en minúsculas
+NON_CANONICAL_PRODUCT_ID = re.compile(r"^(?=.*[A-F])[0-9a-fA-F]{24}$")
+
+def _canonicalize_cart_product_ids(collection, batch_size, sleep, dry_run):
+    """Pasar a minúsculas los IDs de producto de los carritos antiguos, uniendo los items que coincidan"""
+    query = {"items.product_id": {"$regex": NON_CANONICAL_PRODUCT_ID.pattern}}
+    pending = collection.count_documents(query)
+    logger.info(f"{pending} carritos con IDs de producto sin normalizar")
+    if dry_run:
+        return pending
+
+    processed = 0
+    last_id = None
+    while True:
+        batch_query = dict(query, _id={"$gt": last_id}) if last_id else query
+        carts = list(collection.find(batch_query, {"items": 1}).sort("_id", 1).limit(batch_size))
+        if not carts:
+            break
+
+        for cart in carts:
+            items = _merge_cart_items(
+                dict(item, product_id=item["product_id"].lower())
+                if NON_CANONICAL_PRODUCT_ID.match(str(item["product_id"])) else item
+                for item in cart["items"]
+            )
+            # Con los items leídos en el filtro: si el carrito cambió entretanto, no se pisa
+            collection.update_one({"_id": cart["_id"], "items": cart["items"]}, {"$set": dict(
+                _cart_totals(items),
+                items=items,
+                updated_at=datetime.now()
+            )})
+
+        last_id = carts[-1]["_id"]
+        processed += len(carts)
+        logger.info(f"Progreso: {processed}/{pending} carritos normalizados")
+        if sleep:
+            time.sleep(sleep)
+
+    return processed
+
+# Registro ordenado por versión. El nombre identifica la migración en la colección `migrations`
+MIGRATIONS = [
+    Migration(
+        1, "users_default_role", COLLECTION_USERS,
+        {"role": {"$exists": False}},
+        lambda document: "role" not in document,
+        lambda document: {"role": "usuario"}
+    ),
+    Migration(
+        2, "products_updated_at", COLLECTION_PRODUCTS,
+        {"updated_at": {"$exists": False}, "created_at": {"$exists": True}},
+        lambda document: "updated_at" not in document and "created_at" in document,
+        lambda document: {"updated_at": document["created_at"]},
+        fields=("created_at",)
+    ),
+    Migration(
+        3, "products_normalize_price", COLLECTION_PRODUCTS,
+        {"price": {"$type": "string"}},
+        lambda document: isinstance(document.get("price"), str),
+        _normalize_price,
+        fields=("price",)
+    ),
+    ScriptMigration(4, "cart_merge_duplicates", COLLECTION_CART, _merge_duplicate_carts),
+    ScriptMigration(5, "cart_canonical_product_ids", COLLECTION_CART, _canonicalize_cart_product_ids)
+]
+
+_MIGRATIONS_BY_COLLECTION = {}
+for _migration in MIGRATIONS:
+    if isinstance(_migration, Migration):
+        _MIGRATIONS_BY_COLLECTION.setdefault(_migration.collection, []).append(_migration)
+
+def get_migration(name):
+    """Buscar una migración registrada por nombre"""
+    return next((migration for migration in MIGRATIONS if migration.name == name), None)
+
+def upgrade_document(collection, document):
+    """Aplicar en memoria las migraciones pendientes de un documento recién leído"""
+    for migration in _MIGRATIONS_BY_COLLECTION.get(collection, ()):
+        if migration.needs_upgrade(document):
+            document.update(migration.upgrade(document))
+    return document
+
+class MigrationRunner:
+    def __init__(self, db, batch_size=1000, sleep=0.1):
+        self.db = db
+        self.batch_size = batch_size
+        self.sleep = sleep
+
+    def status(self):
+        """Estado de cada migración registrada"""
+        states = {state["_id"]: state for state in self.db[COLLECTION_MIGRATIONS].find()}
+        return [
+            {
+                "version": migration.version,
+                "name": migration.name,
+                "status": states.get(migration.name, {}).get("status", "pending"),
+                "migrated": states.get(migration.name, {}).get("migrated", 0)
+            } for migration in MIGRATIONS
+        ]
+
+    def run(self, migration, dry_run=False, restart=False):
+        """Ejecutar una migración por lotes, reanudando desde su checkpoint"""
+        collection = self.db[migration.collection]
+        migrations = self.db[COLLECTION_MIGRATIONS]
+        label = f"{migration.version:03d} {migration.name}"
+
+        state = None if restart else migrations.find_one({"_id": migration.name})
+        if state and state.get("status") == "completed":
+            logger.info(f"[{label}] ya aplicada")
+            return 0
+
+        if isinstance(migration, ScriptMigration):
+            processed = migration.apply(collection, self.batch_size, self.sleep, dry_run)
+            if not dry_run:
+                self._mark_completed(migration, processed)
+                logger.info(f"[{label}] completada: {processed} documentos migrados")
+            return processed
+
+        last_id = state.get("last_id") if state else None
+        migrated = state.get("migrated", 0) if state else 0
+
+        def pending_query():
+            return dict(migration.query, _id={"$gt": last_id}) if last_id else dict(migration.query)
+
+        pending = collection.count_documents(pending_query())
+        logger.info(f"[{label}] {pending} documentos pendientes")
+        if last_id:
+            logger.info(f"[{label}] reanudando desde el checkpoint {last_id} ({migrated} ya migrados)")
+        if dry_run:
+            return pending
+
+        processed = 0
+        while True:
+            documents = list(collection.find(pending_query(), migration.projection).sort("_id", 1).limit(self.batch_size))
+            if not documents:
+                break
+
+            requests = []
+            for document in documents:
+                fields = migration.upgrade(document)
+                if fields:
+                    # La consulta se repite en el filtro: si otro proceso ya lo migró, no se pisa
+                    requests.append(UpdateOne(dict(migration.query, _id=document["_id"]), {"$set": fields}))
+            if requests:
+                migrated += collection.bulk_write(requests, ordered=False).modified_count
+
+            last_id = documents[-1]["_id"]
+            processed += len(documents)
+            migrations.update_one(
+                {"_id": migration.name},
+                {"$set": {
+                    "version": migration.version,
+                    "last_id": last_id,
+                    "migrated": migrated,
+                    "status": "running",
+                    "updated_at": datetime.now()
+                }},
+                upsert=True
+            )
+            logger.info(f"[{label}] progreso: {processed}/{pending} procesados ({migrated} migrados en total)")
+
+            # Pausa entre lotes para no saturar la base de datos en producción
+            if self.sleep:
+                time.sleep(self.sleep)
+
+        self._mark_completed(migration, migrated)
+        logger.info(f"[{label}] completada: {migrated} documentos migrados")
+        return processed
+
+    def _mark_completed(self, migration, migrated):
+        self.db[COLLECTION_MIGRATIONS].update_one(
+            {"_id": migration.name},
+            {"$set": {
+                "version": migration.version,
+                "migrated": migrated,
+                "status": "completed",
+                "applied_at": datetime.now(),
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
@@ -0,0 +1,122 @@
+"""
+Índice invertido en memoria para la búsqueda de productos
+"""
+
+from collections import defaultdict
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+
+# Peso de cada campo al calcular la relevancia
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "category": 2.0,
+    "color": 1.5,
+    "description": 1.0
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize(text):
+    """Pasar a minúsculas y eliminar acentos ("Básica" -> "basica")"""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def tokenize(text):
+    """Dividir un texto normalizado en términos, reduciendo el plural simple ("camisetas" -> "camiseta")"""
+    return [
+        term[:-1] if len(term) > 3 and term.endswith("s") else term
+        for term in TOKEN_PATTERN.findall(normalize(text))
+    ]
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._lock = threading.Lock()
+        # Cambios recibidos mientras se construye un índice nuevo: (product_id, documento o None)
+        self._pending = None
+        self.built_at = None
+
+    def build(self, documents):
+        """Reconstruir el índice completo; se construye aparte y se sustituye de una vez"""
+        postings = defaultdict(dict)
+        doc_terms = {}
+        with self._lock:
+            self._pending = []
+        try:
+            # Sin el lock: las búsquedas siguen respondiendo con el índice anterior
+            for document in documents:
+                _add(postings, doc_terms, document)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            # Los productos añadidos o borrados durante la construcción se aplican al índice nuevo
+            for product_id, document in self._pending:
+                _remove(postings, doc_terms, product_id)
+                if document is not None:
+                    _add(postings, doc_terms, document)
+            self._postings = postings
+            self._doc_terms = doc_terms
+            self._pending = None
+            self.built_at = time.monotonic()
+
+    def add(self, document):
+        """Indexar un producto nuevo o reindexar uno modificado"""
+        product_id = str(document["_id"])
+        with self._lock:
+            _remove(self._postings, self._doc_terms, product_id)
+            _add(self._postings, self._doc_terms, document)
+            if self._pending is not None:
+                self._pending.append((product_id, document))
+
+    def remove(self, product_id):
+        """Quitar un producto del índice"""
+        product_id = str(product_id)
+        with self._lock:
+            _remove(self._postings, self._doc_terms, product_id)
+            if self._pending is not None:
+                self._pending.append((product_id, None))
+
+    def search(self, query, limit=20):
+        """Obtener los IDs más relevantes para la consulta, de mayor a menor puntuación"""
+        terms = set(tokenize(query))
+        with self._lock:
+            total = len(self._doc_terms)
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + total / len(postings))
+                for product_id, weight in postings.items():
+                    scores[product_id] += weight * idf
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [(product_id, round(score, 4)) for product_id, score in best]
+
+def _add(postings, doc_terms, document):
+    product_id = str(document["_id"])
+    weights = defaultdict(float)
+    for field, field_weight in FIELD_WEIGHTS.items():
+        for term in tokenize(document.get(field) or ""):
+            weights[term] += field_weight
+
+    for term, weight in weights.items():
+        postings[term][product_id] = weight
+    doc_terms[product_id] = list(weights)
+
+def _remove(postings, doc_terms, product_id):
+    for term in doc_terms.pop(product_id, []):
+        term_postings = postings.get(term)
+        if term_postings is None:
+            continue
+        term_postings.pop(product_id, None)
+        if not term_postings:
+            del postings[term]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Pruebas de los componentes en memoria: tokens de sesión, límite de intentos, caché y cursores
+No necesitan MongoDB
+Uso: python test_components.py
+"""
+
+import os
+import sys
+import time
+
+# config.py exige MONGODB_URI al importarse; estas pruebas nunca llegan a conectarse
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+from auth_tokens import issue_token, verify_token, TokenRevocations
+from cache_manager import TTLCache
+from database_manager import encode_cursor, decode_cursor
+from rate_limiter import TokenBucketLimiter
+
+def check(condition, message):
+    """Mostrar el resultado de una comprobación y fallar si no se cumple"""
+    print(f"   {'✅' if condition else '❌'} {message}")
+    assert condition, message
+
+def test_tokens():
+    """Probar firma, manipulación y expiración de los tokens"""
+    print("🔑 Probando Tokens de Sesión")
+    print("-" * 40)
+    
+    token = issue_token("user_id", "editor@tienda.com", "editor")
+    payload = verify_token(token)
+    check(payload is not None and payload["role"] == "editor", "Un token recién emitido es válido")
+    
+    # Cambiar el rol del contenido sin volver a firmar
+    payload_part, signature = token.split(".")
+    forged = issue_token("user_id", "editor@tienda.com", "administrador").split(".")[0]
+    check(verify_token(f"{forged}.{signature}") is None, "Un token con el contenido manipulado se rechaza")
+    check(verify_token(f"{payload_part}.{signature[:-2]}xx") is None, "Un token con la firma manipulada se rechaza")
+    check(verify_token("no-es-un-token") is None, "Un texto sin formato de token se rechaza")
+    
+    expired = issue_token("user_id", "editor@tienda.com", "editor", ttl=-1)
+    check(verify_token(expired) is None, "Un token expirado se rechaza")
+
+def test_token_revocation():
+    """Probar que un cambio de rol invalida los tokens emitidos antes"""
+    print("\n🚫 Probando Revocación por Cambio de Rol")
+    print("-" * 40)
+    
+    revocations = TokenRevocations()
+    before = verify_token(issue_token("user_id", "usuario@tienda.com", "editor"))
+    check(revocations.is_current(before), "Sin cambios de rol el token sigue vigente")
+    
+    time.sleep(0.05)
+    revocations.revoke("usuario@tienda.com")
+    time.sleep(0.05)
+    after = verify_token(issue_token("user_id", "usuario@tienda.com", "usuario"))
+    other = verify_token(issue_token("other_id", "otro@tienda.com", "editor"))
+    
+    check(not revocations.is_current(before), "Un token emitido antes del cambio de rol se rechaza")
+    check(revocations.is_current(after), "Un token emitido después del cambio de rol es válido")
+    check(revocations.is_current(other), "El cambio de rol no afecta a otros usuarios")
+
+def test_rate_limiter():
+    """Probar la recarga del token bucket y el tiempo de espera"""
+    print("\n⏱️ Probando Límite de Intentos")
+    print("-" * 40)
+    
+    limiter = TokenBucketLimiter(capacity=2, refill_per_minute=1, max_keys=100)
+    check(limiter.acquire("ip") == 0 and limiter.acquire("ip") == 0, "Se permiten tantos intentos como la capacidad")
+    check(limiter.acquire("ip") == 60, "Sin tokens se indica la espera (Retry-After) hasta el siguiente")
+    check(limiter.acquire("otra-ip") == 0, "Cada clave tiene su propio bucket")
+    limiter.reset("ip")
+    check(limiter.acquire("ip") == 0, "reset olvida el historial de la clave")
+    
+    # 6000 por minuto: un token cada 10 ms
+    fast = TokenBucketLimiter(capacity=1, refill_per_minute=6000, max_keys=100)
+    fast.acquire("ip")
+    check(fast.acquire("ip") == 1, "La espera se redondea hacia arriba a segundos enteros")
+    time.sleep(0.05)
+    check(fast.acquire("ip") == 0, "El bucket se recarga con el tiempo")
+    
+    small = TokenBucketLimiter(capacity=1, refill_per_minute=1, max_keys=2)
+    small.acquire("a")
+    small.acquire("b")
+    small.acquire("a")
+    small.acquire("c")
+    check(small.acquire("a") > 0, "La clave usada recientemente conserva su bucket")
+    check(small.acquire("b") == 0, "Al superar max_keys se expulsa la clave menos reciente")
+
+def test_cache():
+    """Probar la expulsión LRU y la expiración de la caché"""
+    print("\n🗄️ Probando Caché en Memoria")
+    print("-" * 40)
+    
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    check(cache.get("b") is None, "Se expulsa la entrada usada menos recientemente")
+    check(cache.get("a") == 1 and cache.get("c") == 3, "Se conservan las entradas recientes")
+    check(cache.stats()["evictions"] == 1, "Las expulsiones se cuentan en las métricas")
+    
+    cache.invalidate("a")
+    check(cache.get("a") is None, "invalidate elimina la entrada")
+    
+    expiring = TTLCache(maxsize=2, ttl=0)
+    expiring.set("a", 1)
+    check(expiring.get("a") is None, "Una entrada expirada no se devuelve")
+
+def test_cursors():
+    """Probar la codificación de los cursores de paginación"""
+    print("\n📄 Probando Cursores de Paginación")
+    print("-" * 40)
+    
+    values = {"price": 19.99, "_id": "65a1b2c3d4e5f6a7b8c9d0e1", "name": "Camiseta básica"}
+    cursor = encode_cursor(values)
+    check(decode_cursor(cursor) == values, "Un cursor se decodifica con los mismos valores")
+    check("=" not in cursor, "El cursor no lleva relleno y se puede usar en la URL")
+    check(decode_cursor("no es un cursor") is None, "Un cursor inválido se rechaza")
+    check(decode_cursor(encode_cursor([1, 2])) is None, "Un cursor que no es un objeto se rechaza")
+
+def main():
+    print("🧪 Pruebas de Componentes en Memoria")
+    print("=" * 50)
+    
+    failures = 0
+    for test in (test_tokens, test_token_revocation, test_rate_limiter, test_cache, test_cursors):
+        try:
+            test()
+        except AssertionError:
+            failures += 1
+    
+    if failures:
+        print(f"\n❌ {failures} grupos de pruebas con errores")
+        sys.exit(1)
+    print("\n🎉 ¡Todas las pruebas pasaron!")
+
+if __name__ == "__main__":
+    main()